@@ -0,0 +1,645 @@
+#!/usr/bin/env python3
+"""
+Media Uploader Benchmarks
+Measures telegram_uploader.py against a local HTTP server and a fake Telegram client
+instead of Google Drive and Telegram
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import mimetypes
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import aiofiles
+import telegram_uploader
+from aiohttp import web
+from PIL import Image
+from pyrogram import raw
+from pyrogram.errors import FloodWait
+from pyrogram.parser import Parser
+
+def make_payload(size):
+    """Build a deterministic payload of the given size"""
+    block = os.urandom(1024 * 1024)
+    return (block * (size // len(block) + 1))[:size]
+
+def make_logo(index):
+    """Build a small PNG logo with a colour derived from index"""
+    output = io.BytesIO()
+    Image.new('RGB', (640, 360), ((index * 67) % 256, (index * 131) % 256, 160)).save(output, 'PNG')
+    return output.getvalue()
+
+def make_video(path, duration, gop):
+    """Encode a synthetic H.264/AAC video with ffmpeg, with a keyframe every ``gop`` frames at 30 fps"""
+    # Noise keeps the bitrate high so a few seconds of video yield enough bytes to split
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc2=size=1280x720:rate=30:duration={duration},noise=alls=40:allf=t",
+        '-f', 'lavfi', '-i', f"sine=frequency=440:duration={duration}",
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(gop), '-c:a', 'aac', '-shortest', path
+    ], check=True)
+
+class LocalMediaServer:
+    """Local HTTP server serving synthetic files with Range support and a per-connection bandwidth cap
+
+    Without ``files`` every path serves ``payload``; with it, each path is
+    looked up by name. A ``fail_rate`` share of GET requests is answered with
+    a 503 or cut off halfway, to exercise the retry paths.
+    """
+
+    def __init__(self, payload, bandwidth=0, port=0, files=None, fail_rate=0.0, seed=0):
+        self.payload = payload
+        self.bandwidth = bandwidth  # bytes/sec per connection, 0 = unlimited
+        self.port = port
+        self.files = files
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.failures = 0
+        self.runner = None
+
+    async def handle(self, request):
+        if self.files is None:
+            payload = self.payload
+        elif request.match_info['name'] in self.files:
+            payload = self.files[request.match_info['name']]
+        else:
+            raise web.HTTPNotFound()
+
+        size = len(payload)
+        content_type = mimetypes.guess_type(request.path)[0] or 'application/octet-stream'
+        headers = {'Accept-Ranges': 'bytes', 'Content-Type': content_type}
+
+        if request.method == 'HEAD':
+            headers['Content-Length'] = str(size)
+            return web.Response(headers=headers)
+
+        start, end = 0, size - 1
+        status = 200
+        if request.http_range.start is not None or request.http_range.stop is not None:
+            byte_range = request.http_range
+            start = byte_range.start or 0
+            end = (byte_range.stop or size) - 1
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+        failure = None
+        if self.fail_rate and self.random.random() < self.fail_rate:
+            self.failures += 1
+            failure = self.random.choice(['unavailable', 'truncate'])
+            if failure == 'unavailable':
+                raise web.HTTPServiceUnavailable()
+
+        headers['Content-Length'] = str(end - start + 1)
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+
+        chunk_size = 256 * 1024
+        started = time.monotonic()
+        sent = 0
+        for offset in range(start, end + 1, chunk_size):
+            if failure == 'truncate' and sent >= (end - start + 1) // 2:
+                # Drop the connection halfway through the body
+                request.transport.close()
+                return response
+
+            chunk = bytes(payload[offset:min(offset + chunk_size, end + 1)])
+            await response.write(chunk)
+            sent += len(chunk)
+
+            # Throttle to the configured per-connection bandwidth
+            if self.bandwidth:
+                ahead = sent / self.bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+
+        await response.write_eof()
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/{name:.*}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+class FakeTelegramClient:
+    """Stand-in for pyrogram.Client with the calls telegram_uploader makes
+
+    File parts are paced to ``bandwidth`` bytes/sec per session after a fixed
+    ``latency`` per request, and every ``flood_every``-th message send is
+    answered with a FloodWait of ``flood_seconds``. Nothing leaves the machine.
+    """
+
+    def __init__(self, name, api_id=None, api_hash=None, session_string=None,
+                 bandwidth=0, latency=0.0, flood_every=0, flood_seconds=1):
+        self.name = name
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.parser = Parser(self)
+        self.busy_until = 0.0
+        self.sends = 0
+        self.messages = []
+        self.uploaded_bytes = 0
+        self.rnd_id = lambda: random.getrandbits(63)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def guess_mime_type(self, filename):
+        return mimetypes.guess_type(filename)[0]
+
+    async def resolve_peer(self, peer_id):
+        return raw.types.InputPeerSelf()
+
+    async def save_file(self, path):
+        await self._transfer(os.path.getsize(path))
+        return raw.types.InputFile(id=self.rnd_id(), parts=1, name=os.path.basename(path), md5_checksum='')
+
+    async def _transfer(self, size):
+        """Wait until ``size`` bytes would have gone over this session's link"""
+        now = time.monotonic()
+        if self.bandwidth:
+            self.busy_until = max(self.busy_until, now) + size / self.bandwidth
+            await asyncio.sleep(self.busy_until - now + self.latency)
+        elif self.latency:
+            await asyncio.sleep(self.latency)
+        self.uploaded_bytes += size
+
+    def _send(self):
+        """Count a message send, raising the injected FloodWait when it is due"""
+        self.sends += 1
+        if self.flood_every and self.sends % self.flood_every == 0:
+            raise FloodWait(value=self.flood_seconds)
+        self.messages.append(time.monotonic())
+        return len(self.messages)
+
+    async def invoke(self, query):
+        if isinstance(query, (raw.functions.upload.SaveFilePart, raw.functions.upload.SaveBigFilePart)):
+            await self._transfer(len(query.bytes))
+            return True
+        if isinstance(query, raw.functions.messages.SendMedia):
+            await asyncio.sleep(self.latency)
+            message_id = self._send()
+            return SimpleNamespace(updates=[raw.types.UpdateMessageID(id=message_id, random_id=query.random_id)])
+        if isinstance(query, raw.functions.messages.UploadMedia):
+            await asyncio.sleep(self.latency)
+            return SimpleNamespace(document=SimpleNamespace(id=self.rnd_id(), access_hash=0, file_reference=b''))
+        if isinstance(query, raw.functions.messages.SendMultiMedia):
+            # An album is one send however many messages it creates
+            await asyncio.sleep(self.latency)
+            message_id = self._send()
+            for _ in query.multi_media[1:]:
+                self.messages.append(time.monotonic())
+            return SimpleNamespace(updates=[
+                raw.types.UpdateMessageID(id=message_id + i, random_id=single.random_id)
+                for i, single in enumerate(query.multi_media)
+            ])
+        raise NotImplementedError(f"FakeTelegramClient does not implement {type(query).__name__}")
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(id=self._send())
+
+class ResourceSampler:
+    """Track peak RSS of this process and peak bytes under a directory while a run is going"""
+
+    def __init__(self, directory, interval=0.05):
+        self.directory = directory
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self.task = None
+
+    @staticmethod
+    def rss():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except OSError:
+            # ru_maxrss is in KB on Linux and bytes on macOS, the peak is all we can get
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+    def disk_usage(self):
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                try:
+                    total += os.stat(os.path.join(root, name)).st_blocks * 512
+                except OSError:
+                    pass
+        return total
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, self.rss())
+        self.peak_disk = max(self.peak_disk, self.disk_usage())
+
+    async def run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self.task = asyncio.ensure_future(self.run())
+        return self
+
+    def __exit__(self, *exc_info):
+        self.task.cancel()
+        self.sample()
+
+def make_catalog(count, min_size, max_size, seed=0):
+    """Build catalog entries with sizes spread between min_size and max_size bytes"""
+    rng = random.Random(seed)
+    entries = []
+    for i in range(1, count + 1):
+        size = rng.randint(min_size, max_size)
+        entries.append({
+            'id': i,
+            'name': f"Sample video {i}",
+            'link': f"video_{i}.mp4",
+            'tvg-logo': f"logo_{i % 5}.png",
+            'size': size
+        })
+    return entries
+
+async def bench_e2e(args):
+    """Run the uploader end to end over a synthetic catalog, a local server and fake Telegram sessions"""
+    mb = 1024 * 1024
+    entries = make_catalog(args.entries, int(args.min_size * mb), int(args.max_size * mb), args.seed)
+    payload = make_payload(max(entry['size'] for entry in entries))
+    files = {entry['link']: memoryview(payload)[:entry['size']] for entry in entries}
+    files.update({f"logo_{i}.png": make_logo(i) for i in range(5)})
+
+    server = LocalMediaServer(
+        payload, bandwidth=args.bandwidth * mb, files=files, fail_rate=args.fail_rate, seed=args.seed
+    )
+    base_url = await server.start()
+    for entry in entries[:args.dead]:
+        # Not served, so the link answers 404
+        del files[entry['link']]
+        entry['link'] = f"missing_{entry['id']}.mp4"
+    for entry in entries:
+        entry['link'] = f"{base_url}/{entry['link']}"
+        entry['tvg-logo'] = f"{base_url}/{entry['tvg-logo']}"
+    files['media_data.json'] = json.dumps([
+        {key: value for key, value in entry.items() if key != 'size'} for entry in entries
+    ]).encode()
+
+    clients = []
+
+    def make_client(name, session_string=None):
+        client = FakeTelegramClient(
+            name, bandwidth=args.upload_bandwidth * mb, latency=args.latency / 1000,
+            flood_every=args.flood_every, flood_seconds=args.flood_seconds
+        )
+        clients.append(client)
+        return client
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        tempfile.tempdir = directory
+        telegram_uploader.create_client = make_client
+        config = telegram_uploader.config
+        config.API_ID, config.API_HASH = 1, 'bench'
+        config.GOOGLE_DRIVE_JSON_URL = f"{base_url}/media_data.json"
+        config.SESSION_STRINGS = [f"bench_{i}" for i in range(args.sessions)]
+        config.LEDGER_PATH = ''
+        config.DEDUP_INDEX_PATH = ''
+        config.CATALOG_CACHE_PATH = ''
+        config.METRICS_PATH = ''
+        config.MIN_RANGE_SIZE = mb
+        if args.part_size:
+            config.MAX_FILE_SIZE = int(args.part_size * mb)
+        config.TEMP_BUDGET = int(args.temp_budget * mb)
+        config.PREFLIGHT = args.preflight
+        config.MEDIA_GROUP_MAX_SIZE = int(args.album_size * mb)
+        config.PROBE_CACHE_PATH = ''
+
+        try:
+            with ResourceSampler(directory) as sampler:
+                started = time.monotonic()
+                if args.mode == 'pipeline':
+                    await telegram_uploader.main()
+                else:
+                    # One entry at a time through process_media_entry, as before the pipeline
+                    telegram_uploader.reset_metrics()
+                    client = make_client('media_uploader')
+                    async for entry in telegram_uploader.stream_catalog():
+                        await telegram_uploader.process_media_entry(client, entry)
+                elapsed = time.monotonic() - started
+        finally:
+            os.chdir(cwd)
+            tempfile.tempdir = None
+            await telegram_uploader.close_http_session()
+            await server.stop()
+
+    report = telegram_uploader.get_metrics().report()
+    latencies = sorted(entry['latency'] for entry in report['entries'] if entry['latency'] is not None)
+    total_bytes = sum(entry['size'] for entry in entries[args.dead:])
+    result = {
+        'mode': args.mode,
+        'entries': len(entries),
+        'done': sum(1 for entry in report['entries'] if entry['result'] == 'done'),
+        'seconds': elapsed,
+        'mb_per_second': total_bytes / mb / elapsed,
+        'latency_p50': latencies[len(latencies) // 2] if latencies else None,
+        'latency_max': latencies[-1] if latencies else None,
+        'peak_rss_mb': sampler.peak_rss / mb,
+        'peak_disk_mb': sampler.peak_disk / mb,
+        'messages': sum(len(client.messages) for client in clients),
+        'sends': sum(client.sends for client in clients),
+        'uploaded_mb': sum(client.uploaded_bytes for client in clients) / mb,
+        'server_failures': server.failures,
+        'retries': report['counters']['retries'],
+        'flood_wait_seconds': report['counters']['flood_wait_seconds'],
+        'stages': {stage: totals['seconds'] for stage, totals in report['stages'].items()}
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    print(f"\nEnd to end, {args.mode}: {result['done']}/{len(entries)} entries, "
+          f"{total_bytes / mb:.1f} MB, {args.sessions} session(s)")
+    for key, label, unit in (
+        ('seconds', 'wall clock', 's'),
+        ('mb_per_second', 'throughput', 'MB/s'),
+        ('latency_p50', 'latency p50', 's'),
+        ('latency_max', 'latency max', 's'),
+        ('peak_rss_mb', 'peak RSS', 'MB'),
+        ('peak_disk_mb', 'peak disk', 'MB'),
+        ('messages', 'messages', ''),
+        ('sends', 'send calls', ''),
+        ('retries', 'retries', ''),
+        ('flood_wait_seconds', 'FloodWait', 's')
+    ):
+        value = result[key]
+        line = f"  {label:<12} {'-' if value is None else f'{value:9.2f}'} {unit}"
+        if baseline and baseline.get(key) and value is not None:
+            line += f"  ({(value - baseline[key]) / baseline[key] * 100:+.0f}% vs baseline)"
+        print(line)
+    for stage in telegram_uploader.RunMetrics.STAGES:
+        if stage in result['stages']:
+            print(f"  stage {stage:<9} {result['stages'][stage]:9.2f} s")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+async def bench_download(args):
+    """Compare download_file over one connection with N parallel ranged connections"""
+    payload = make_payload(args.size * 1024 * 1024)
+    server = LocalMediaServer(payload, bandwidth=args.bandwidth * 1024 * 1024)
+    base_url = await server.start()
+
+    results = []
+    try:
+        for connections in sorted({1, args.connections}):
+            telegram_uploader.config.DOWNLOAD_CONNECTIONS = connections
+            telegram_uploader.config.MIN_RANGE_SIZE = 1024 * 1024
+
+            started = time.monotonic()
+            path = await telegram_uploader.download_file(f"{base_url}/video.mp4", "video.mp4")
+            elapsed = time.monotonic() - started
+
+            if not path:
+                print(f"{connections} connection(s): download failed")
+                continue
+
+            try:
+                with open(path, 'rb') as f:
+                    intact = f.read() == payload
+            finally:
+                os.unlink(path)
+
+            results.append((connections, elapsed, intact))
+    finally:
+        await telegram_uploader.close_http_session()
+        await server.stop()
+
+    print(f"\nDownload of {args.size} MB at {args.bandwidth} MB/s per connection:")
+    for connections, elapsed, intact in results:
+        print(f"  {connections:>2} connection(s): {elapsed:6.2f}s  "
+              f"{args.size / elapsed:7.1f} MB/s  {'ok' if intact else 'CORRUPT'}")
+
+async def write_aiofiles(path, chunks):
+    """The earlier download loop: one aiofiles write, and executor hop, per chunk"""
+    async with aiofiles.open(path, 'wb') as f:
+        for chunk in chunks:
+            await f.write(chunk)
+
+async def write_coalesced(path, chunks):
+    async with telegram_uploader.CoalescingWriter(path, truncate=True) as f:
+        for chunk in chunks:
+            await f.write(chunk)
+
+async def split_aiofiles(source_path, part_path, length):
+    """The earlier split loop: 8 KB aiofiles reads and writes"""
+    async with aiofiles.open(source_path, 'rb') as source, aiofiles.open(part_path, 'wb') as part:
+        copied = 0
+        while copied < length:
+            chunk = await source.read(min(8192, length - copied))
+            if not chunk:
+                break
+            await part.write(chunk)
+            copied += len(chunk)
+
+async def split_kernel(source_path, part_path, length):
+    await asyncio.get_running_loop().run_in_executor(
+        None, telegram_uploader.copy_range, source_path, part_path, 0, length
+    )
+
+async def bench_io(args):
+    """Compare CPU per GB of the earlier aiofiles loops with coalesced writes and kernel copies"""
+    size = args.size * 1024 * 1024
+    gb = size / 1024 ** 3
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        target = os.path.join(directory, 'target.bin')
+        block = os.urandom(1024 * 1024)
+        results = []
+
+        cases = [
+            ('download, aiofiles 8 KB writes', write_aiofiles, 8192),
+            ('download, aiofiles 64 KB writes', write_aiofiles, 64 * 1024),
+            ('download, coalesced 8 KB chunks', write_coalesced, 8192),
+            ('download, coalesced 64 KB chunks', write_coalesced, 64 * 1024),
+        ]
+        for label, writer, chunk_size in cases:
+            chunks = (block[offset % len(block):offset % len(block) + chunk_size] for offset in range(0, size, chunk_size))
+            cpu, wall = time.process_time(), time.monotonic()
+            await writer(target, chunks)
+            results.append((label, time.process_time() - cpu, time.monotonic() - wall))
+
+        source = os.path.join(directory, 'source.bin')
+        with open(source, 'wb') as f:
+            for _ in range(args.size):
+                f.write(block)
+        for label, splitter in (('split, aiofiles 8 KB', split_aiofiles), ('split, copy_range', split_kernel)):
+            cpu, wall = time.process_time(), time.monotonic()
+            await splitter(source, target, size)
+            results.append((label, time.process_time() - cpu, time.monotonic() - wall))
+
+    print(f"\nI/O of {args.size} MB:")
+    for label, cpu, wall in results:
+        print(f"  {label:<34} {cpu / gb:7.2f} CPU s/GB  {wall:6.2f}s wall")
+
+async def bench_split(args):
+    """Split a synthetic video at keyframes and check that every part plays on its own"""
+    if not (shutil.which('ffmpeg') and shutil.which('ffprobe')):
+        print("ffmpeg and ffprobe are required for the split benchmark")
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, f"video.{args.container}")
+        make_video(source, args.duration, args.gop)
+        source_size = os.path.getsize(source)
+        chunk_size = args.part_size * 1024 * 1024
+
+        started = time.monotonic()
+        parts = await telegram_uploader.split_keyframes(source, chunk_size)
+        elapsed = time.monotonic() - started
+
+        print(f"\nKeyframe split of {source_size/1024/1024:.1f} MB into {args.part_size} MB parts: {elapsed:.2f}s")
+        for part_path, part_filename in parts:
+            if isinstance(part_path, telegram_uploader.FileRangeView):
+                print(f"  {part_filename}: byte-range fallback, not playable on its own")
+                part_path.close()
+                continue
+
+            size = os.path.getsize(part_path)
+            # Decoding the whole part catches segments that do not start on a keyframe
+            decoded = subprocess.run(
+                ['ffmpeg', '-v', 'error', '-i', part_path, '-f', 'null', '-'],
+                capture_output=True, text=True
+            )
+            playable = decoded.returncode == 0 and not decoded.stderr.strip()
+            print(f"  {part_filename}: {size/1024/1024:6.1f} MB  "
+                  f"{'fits' if size <= chunk_size else 'TOO LARGE'}  {'playable' if playable else 'BROKEN'}")
+
+HEAVY_MODULES = ('pyrogram', 'PIL', 'aiohttp', 'aiofiles')
+
+def time_command(command, runs, env=None, cwd=None):
+    """Median wall time of a command over fresh interpreter runs"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, check=True, env=env, cwd=cwd, capture_output=True)
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
+
+async def bench_startup(args):
+    """Import time of telegram_uploader and the time a --plan run takes, without credentials"""
+    uploader_path = os.path.abspath(telegram_uploader.__file__)
+    env = {key: value for key, value in os.environ.items() if key not in ('API_ID', 'API_HASH', 'SESSION_STRING', 'SESSION_STRINGS')}
+    env['PYTHONPATH'] = os.path.dirname(uploader_path)
+    python = [sys.executable, '-c']
+
+    interpreter = time_command(python + ['pass'], args.runs, env)
+    heavy = time_command(python + [f"import {', '.join(module for module in HEAVY_MODULES)}"], args.runs, env)
+    lazy = time_command(python + ['import telegram_uploader'], args.runs, env)
+    loaded = subprocess.run(
+        python + [f"import sys, telegram_uploader; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"],
+        check=True, env=env, capture_output=True, text=True
+    ).stdout.split()
+
+    with tempfile.TemporaryDirectory() as directory:
+        entries = make_catalog(args.entries, 1, 2000, seed=args.seed)
+        with open(os.path.join(directory, 'media_data.json'), 'w', encoding='utf-8') as f:
+            json.dump([{key: value for key, value in entry.items() if key != 'size'} for entry in entries], f)
+        plan = time_command([sys.executable, uploader_path, '--plan'], args.runs, env, cwd=directory)
+
+    print(f"\nStartup, median of {args.runs} fresh interpreters:")
+    print(f"  {'bare interpreter':<34} {interpreter * 1000:7.1f} ms")
+    print(f"  {'+ ' + ', '.join(HEAVY_MODULES):<34} {(heavy - interpreter) * 1000:7.1f} ms")
+    print(f"  {'+ import telegram_uploader':<34} {(lazy - interpreter) * 1000:7.1f} ms  "
+          f"heavy modules loaded: {', '.join(loaded) or 'none'}")
+    print(f"  {f'--plan of {args.entries} entries':<34} {plan * 1000:7.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    download = subparsers.add_parser('download', help='single vs parallel ranged download')
+    download.add_argument('--size', type=int, default=64, help='file size in MB')
+    download.add_argument('--connections', type=int, default=4, help='parallel connections to compare against 1')
+    download.add_argument('--bandwidth', type=float, default=8, help='per-connection bandwidth cap in MB/s (0 = unlimited)')
+    download.set_defaults(func=bench_download)
+
+    e2e = subparsers.add_parser('e2e', help='whole uploader against a local server and fake Telegram sessions')
+    e2e.add_argument('--mode', choices=['pipeline', 'sequential'], default='pipeline',
+                     help='main() pipeline or one process_media_entry at a time')
+    e2e.add_argument('--entries', type=int, default=12, help='catalog entries')
+    e2e.add_argument('--min-size', type=float, default=1, help='smallest file in MB')
+    e2e.add_argument('--max-size', type=float, default=24, help='largest file in MB')
+    e2e.add_argument('--part-size', type=float, default=0, help='MAX_FILE_SIZE in MB, to exercise splitting (0 = keep)')
+    e2e.add_argument('--temp-budget', type=float, default=0, help='TEMP_BUDGET in MB (0 = free space)')
+    e2e.add_argument('--bandwidth', type=float, default=16, help='download bandwidth cap in MB/s per connection (0 = unlimited)')
+    e2e.add_argument('--dead', type=int, default=0, help='entries whose link answers 404')
+    e2e.add_argument('--preflight', action='store_true', help='HEAD-probe the catalog before processing it')
+    e2e.add_argument('--fail-rate', type=float, default=0.0, help='share of GET requests that fail or are cut off')
+    e2e.add_argument('--album-size', type=float, default=0, help='MEDIA_GROUP_MAX_SIZE in MB (0 = no albums)')
+    e2e.add_argument('--sessions', type=int, default=1, help='fake Telegram sessions')
+    e2e.add_argument('--upload-bandwidth', type=float, default=8, help='upload bandwidth per session in MB/s (0 = unlimited)')
+    e2e.add_argument('--latency', type=float, default=20, help='Telegram request latency in ms')
+    e2e.add_argument('--flood-every', type=int, default=0, help='answer every Nth message send with a FloodWait (0 = never)')
+    e2e.add_argument('--flood-seconds', type=int, default=2, help='FloodWait duration in seconds')
+    e2e.add_argument('--seed', type=int, default=0, help='seed for sizes and injected failures')
+    e2e.add_argument('--output', help='write results as JSON, to use as a later --baseline')
+    e2e.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    e2e.set_defaults(func=bench_e2e)
+
+    io_parser = subparsers.add_parser('io', help='CPU per GB of download writes and file splitting')
+    io_parser.add_argument('--size', type=int, default=512, help='bytes to write and copy, in MB')
+    io_parser.add_argument('--dir', help='directory on the disk to test (default: system temp)')
+    io_parser.set_defaults(func=bench_io)
+
+    split = subparsers.add_parser('split', help='keyframe split of a synthetic video')
+    split.add_argument('--duration', type=int, default=60, help='video length in seconds')
+    split.add_argument('--gop', type=int, default=60, help='frames between keyframes')
+    split.add_argument('--part-size', type=int, default=8, help='maximum part size in MB')
+    split.add_argument('--container', choices=['mp4', 'mkv'], default='mp4', help='container of the synthetic video')
+    split.set_defaults(func=bench_split)
+
+    startup = subparsers.add_parser('startup', help='import time and --plan run time without credentials')
+    startup.add_argument('--entries', type=int, default=5000, help='catalog entries for the --plan run')
+    startup.add_argument('--runs', type=int, default=5, help='fresh interpreters per measurement')
+    startup.add_argument('--seed', type=int, default=0, help='seed for the catalog')
+    startup.set_defaults(func=bench_startup)
+
+    parser.add_argument('-v', '--verbose', action='store_true', help='show uploader log output')
+
+    args = parser.parse_args()
+    if not args.verbose:
+        telegram_uploader.logger.setLevel(logging.WARNING)
+        logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
+    asyncio.run(args.func(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,53 +4,14 @@ Google Drive URL Utility
 Converts Google Drive sharing URLs to direct download links
 """
 
+import argparse
+import json
 import sys
-import re
 
-def convert_google_drive_url(url):
-    """
-    Convert Google Drive sharing URL to direct download URL
+from drive_urls import convert_catalog, convert_google_drive_url
 
-    Input formats supported:
-    - https://drive.google.com/file/d/FILE_ID/view?usp=sharing
-    - https://drive.google.com/open?id=FILE_ID
-    - https://drive.google.com/file/d/FILE_ID/view
-
-    Output format:
-    - https://drive.google.com/uc?export=download&id=FILE_ID
-    """
-
-    # Pattern 1: /file/d/FILE_ID/view format
-    pattern1 = r'drive\.google\.com/file/d/([a-zA-Z0-9_-]+)'
-    match1 = re.search(pattern1, url)
-
-    if match1:
-        file_id = match1.group(1)
-        return f"https://drive.google.com/uc?export=download&id={file_id}"
-
-    # Pattern 2: open?id=FILE_ID format
-    pattern2 = r'drive\.google\.com/open\?id=([a-zA-Z0-9_-]+)'
-    match2 = re.search(pattern2, url)
-
-    if match2:
-        file_id = match2.group(1)
-        return f"https://drive.google.com/uc?export=download&id={file_id}"
-
-    # If already a direct download URL, return as is
-    if 'drive.google.com/uc?export=download' in url:
-        return url
-
-    # If no pattern matches, return original URL
-    return url
-
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python gdrive_converter.py <google_drive_url>")
-        print("\nExample:")
-        print("python gdrive_converter.py 'https://drive.google.com/file/d/1ABC123DEF456/view?usp=sharing'")
-        sys.exit(1)
-
-    input_url = sys.argv[1]
+def convert_url(input_url):
+    """Print the direct download URL of a single link"""
     converted_url = convert_google_drive_url(input_url)
 
     print("Original URL:")
@@ -63,5 +24,36 @@ def main():
     else:
         print("\n⚠️  URL was not converted (already direct or unsupported format)")
 
+def convert_catalog_file(path, output=None):
+    """Rewrite the Drive links of a media_data.json style catalog"""
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+
+    converted = convert_catalog(entries)
+
+    output = output or path
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ Converted {converted} link(s) in {len(entries)} entries, written to {output}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert Google Drive sharing URLs to direct download links",
+        epilog="Example: python gdrive_converter.py 'https://drive.google.com/file/d/1ABC123DEF456/view?usp=sharing'"
+    )
+    parser.add_argument('url', nargs='?', help='Google Drive URL to convert')
+    parser.add_argument('--catalog', metavar='JSON', help='convert every link in a catalog file instead')
+    parser.add_argument('-o', '--output', help='where to write the converted catalog (default: in place)')
+    args = parser.parse_args()
+
+    if args.catalog:
+        convert_catalog_file(args.catalog, args.output)
+    elif args.url:
+        convert_url(args.url)
+    else:
+        parser.print_usage()
+        sys.exit(1)
+
 if __name__ == "__main__":
     main()
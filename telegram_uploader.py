@@ -1,97 +1,839 @@
+import argparse
 import asyncio
+import codecs
+import contextlib
+import contextvars
+import csv
+import glob
+import hashlib
+import io
 import json
 import os
+import re
+import shutil
+import sys
 import tempfile
-import requests
-from pyrogram import Client
-from pyrogram.types import InputMediaVideo
-from pyrogram.enums import ParseMode
-from PIL import Image
+import time
+import weakref
 import logging
 from urllib.parse import urlparse
-import aiohttp
-import aiofiles
 import math
-from aiohttp import ClientError, ClientTimeout, ContentTypeError
+from drive_urls import convert_google_drive_url, extract_file_id, resolve_download_url
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Configuration
-API_ID = int(os.getenv('API_ID'))
-API_HASH = os.getenv('API_HASH')
-SESSION_STRING = os.getenv('SESSION_STRING')
 GROUP_ID = "@filexshit"  # Your target group ID
-START_FROM_ID = int(os.getenv('START_FROM_ID', '0'))  # Start uploading from this ID
-GOOGLE_DRIVE_JSON_URL = os.getenv('GOOGLE_DRIVE_JSON_URL')  # Google Drive direct download link
-MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', '1900000000'))  # 1.9GB for splitting
-TELEGRAM_LIMIT = int(os.getenv('TELEGRAM_LIMIT', '2000000000'))  # 2GB Telegram absolute limit
-DOWNLOAD_TIMEOUT = int(os.getenv('DOWNLOAD_TIMEOUT', '3600'))  # 1 hour timeout
-MAX_RETRIES = int(os.getenv('MAX_RETRIES', '3'))  # Number of download retries
-
-def convert_google_drive_url(url):
-    """Convert Google Drive sharing URL to direct download URL"""
-    if 'drive.google.com' in url and '/file/d/' in url:
-        # Extract file ID from sharing URL
-        file_id = url.split('/file/d/')[1].split('/')[0]
-        return f"https://drive.google.com/uc?export=download&id={file_id}"
-    return url
+UPLOAD_PART_SIZE = 512 * 1024  # Telegram upload part size
+KEYFRAME_SPLIT_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.mkv')  # Containers split at keyframes in 'keyframe' mode
+CAPTION_LIMIT = 1024  # Telegram caption limit in UTF-16 code units
+MEDIA_GROUP_LIMIT = 10  # Telegram album limit
+WRITE_BUFFER_SECONDS = 0.25  # Coalesced writes hold about this long of observed bandwidth
+WRITE_ALIGN = 64 * 1024  # Coalesced writes end on multiples of this file offset
+TEMP_PREFIX = 'media_uploader_'  # Marks temp files and parts so orphans can be found
+
+class ConfigError(ValueError):
+    """Invalid or missing settings, all of them listed in the message"""
+
+class Config:
+    """Settings read from the environment, with every problem collected in ``errors`` for check()"""
+
+    def __init__(self, environ=None):
+        self.environ = os.environ if environ is None else environ
+        self.errors = []
+
+        self.API_ID = self.integer('API_ID', 0)  # Telegram API ID, required to upload
+        self.API_HASH = self.text('API_HASH')  # Telegram API hash, required to upload
+        self.SESSION_STRINGS = self.text('SESSION_STRINGS', self.text('SESSION_STRING')).replace(',', ' ').split()  # Session pool, comma or whitespace separated
+        self.START_FROM_ID = self.integer('START_FROM_ID', 0)  # Start uploading from this ID
+        self.GOOGLE_DRIVE_JSON_URL = self.text('GOOGLE_DRIVE_JSON_URL')  # Google Drive direct download link
+        self.MAX_FILE_SIZE = self.integer('MAX_FILE_SIZE', 1900000000, minimum=1)  # 1.9GB for splitting
+        self.TELEGRAM_LIMIT = self.integer('TELEGRAM_LIMIT', 2000000000, minimum=1)  # 2GB Telegram absolute limit
+        self.DOWNLOAD_TIMEOUT = self.integer('DOWNLOAD_TIMEOUT', 3600, minimum=1)  # 1 hour timeout
+        self.MAX_RETRIES = self.integer('MAX_RETRIES', 3, minimum=1)  # Number of download retries
+        self.DOWNLOAD_CONNECTIONS = self.integer('DOWNLOAD_CONNECTIONS', 4, minimum=1)  # Parallel ranged connections per file
+        self.MIN_RANGE_SIZE = self.integer('MIN_RANGE_SIZE', 16 * 1024 * 1024, minimum=1)  # Smallest byte range per connection
+        self.HTTP_POOL_LIMIT = self.integer('HTTP_POOL_LIMIT', 32, minimum=1)  # Connections in the shared HTTP pool
+        self.HTTP_PER_HOST_LIMIT = self.integer('HTTP_PER_HOST_LIMIT', 16, minimum=1)  # Connections per host in the shared pool
+        self.DOWNLOAD_CONCURRENCY = self.integer('DOWNLOAD_CONCURRENCY', 2, minimum=1)  # Entries downloading at once
+        self.UPLOAD_CONCURRENCY = self.integer('UPLOAD_CONCURRENCY', 1, minimum=1)  # Entries uploading at once
+        self.PIPELINE_DEPTH = self.integer('PIPELINE_DEPTH', 1)  # Downloaded entries allowed to wait for upload
+        self.SEND_RATE = self.number('SEND_RATE', 0.2)  # Initial messages per second per client
+        self.SEND_RATE_MIN = self.number('SEND_RATE_MIN', 0.02)  # Floor after repeated FloodWaits
+        self.SEND_RATE_MAX = self.number('SEND_RATE_MAX', 0.5)  # Ceiling the rate recovers towards
+        self.SEND_BURST = self.integer('SEND_BURST', 2, minimum=1)  # Messages that may be sent back to back
+        self.FLOOD_WAIT_RETRIES = self.integer('FLOOD_WAIT_RETRIES', 5)  # FloodWaits tolerated per call
+        self.STREAM_MODE = self.flag('STREAM_MODE')  # Upload straight from the download stream
+        self.STREAM_BUFFER_SIZE = self.integer('STREAM_BUFFER_SIZE', 64 * 1024 * 1024, minimum=1)  # In-memory stream buffer
+        self.UPLOAD_PART_WORKERS = self.integer('UPLOAD_PART_WORKERS', 4, minimum=1)  # Upload parts in flight per file
+        self.LEDGER_PATH = self.text('LEDGER_PATH', 'upload_ledger.jsonl')  # Resumable job ledger, empty to disable
+        self.LEDGER_SYNC_BYTES = self.integer('LEDGER_SYNC_BYTES', 32 * 1024 * 1024, minimum=1)  # Download progress checkpoint interval
+        self.DEDUP_INDEX_PATH = self.text('DEDUP_INDEX_PATH', 'dedup_index.json')  # URL/content-hash index of posted media, empty to disable
+        self.CATALOG_CACHE_PATH = self.text('CATALOG_CACHE_PATH', 'catalog_cache.json')  # Catalog validators and fingerprints, empty to disable
+        self.THUMB_CACHE_DIR = self.text('THUMB_CACHE_DIR', 'thumb_cache')  # Processed thumbnails keyed by logo URL
+        self.THUMB_CACHE_MAX_BYTES = self.integer('THUMB_CACHE_MAX_BYTES', 64 * 1024 * 1024)  # Thumbnail cache size budget
+        self.SPLIT_MODE = self.choice('SPLIT_MODE', 'view', ('view', 'copy', 'keyframe'))  # 'view' uploads byte ranges in place, 'copy' writes .partNNN files, 'keyframe' cuts playable segments with ffmpeg
+        self.MEDIA_GROUP_MAX_SIZE = self.integer('MEDIA_GROUP_MAX_SIZE', 0)  # Files up to this size are posted as albums, 0 to disable
+        self.MEDIA_GROUP_WAIT = self.number('MEDIA_GROUP_WAIT', 30)  # Seconds an album waits for the next entry to be prepared
+        self.WRITE_BUFFER_MIN = self.integer('WRITE_BUFFER_MIN', 1024 * 1024, minimum=1)  # Smallest coalesced disk write
+        self.WRITE_BUFFER_MAX = self.integer('WRITE_BUFFER_MAX', 8 * 1024 * 1024, minimum=1)  # Largest coalesced disk write
+        self.PREFLIGHT = self.flag('PREFLIGHT')  # HEAD-probe the whole catalog before processing it
+        self.PREFLIGHT_CONCURRENCY = self.integer('PREFLIGHT_CONCURRENCY', 16, minimum=1)  # HEAD probes in flight during the sweep
+        self.PREFLIGHT_ORDER = self.choice('PREFLIGHT_ORDER', 'size', ('size', 'catalog'))  # 'size' processes small files first, 'catalog' keeps catalog order
+        self.PROBE_CACHE_PATH = self.text('PROBE_CACHE_PATH', 'probe_cache.json')  # HEAD probe results, empty to disable
+        self.PROBE_CACHE_TTL = self.integer('PROBE_CACHE_TTL', 6 * 3600)  # Seconds a cached probe stays valid
+        self.TEMP_DIR = self.text('TEMP_DIR')  # Downloads and split parts, empty for the system temp directory
+        self.TEMP_BUDGET = self.integer('TEMP_BUDGET', 0)  # Bytes of temp storage entries may reserve, 0 for the free space
+        self.TEMP_FREE_MARGIN = self.integer('TEMP_FREE_MARGIN', 512 * 1024 * 1024)  # Free space always left on the temp disk
+        self.METRICS_PATH = self.text('METRICS_PATH', 'run_metrics.json')  # Run report, .csv for one row per entry, empty to disable
+        self.METRICS_PROM_PATH = self.text('METRICS_PROM_PATH')  # Prometheus text-format export, empty to disable
+        self.SHARD_INDEX = self.integer('SHARD_INDEX', 0)  # This process's shard
+        self.SHARD_COUNT = self.integer('SHARD_COUNT', 1, minimum=1)  # Shards the catalog is partitioned into
+        self.SHARD_MODE = self.choice('SHARD_MODE', 'hash', ('hash', 'range'))  # 'hash' spreads IDs evenly, 'range' keeps blocks of SHARD_BLOCK consecutive IDs together
+        self.SHARD_BLOCK = self.integer('SHARD_BLOCK', 100, minimum=1)  # IDs per block in 'range' mode
+
+        if self.SHARD_INDEX >= self.SHARD_COUNT:
+            self.errors.append(f"SHARD_INDEX must be below SHARD_COUNT ({self.SHARD_COUNT}), got {self.SHARD_INDEX}")
+        if not 0 < self.SEND_RATE_MIN <= self.SEND_RATE <= self.SEND_RATE_MAX:
+            self.errors.append("SEND_RATE must lie between SEND_RATE_MIN and SEND_RATE_MAX, all above 0")
+        if self.WRITE_BUFFER_MIN > self.WRITE_BUFFER_MAX:
+            self.errors.append("WRITE_BUFFER_MIN must not exceed WRITE_BUFFER_MAX")
+        if self.MAX_FILE_SIZE > self.TELEGRAM_LIMIT:
+            self.errors.append("MAX_FILE_SIZE must not exceed TELEGRAM_LIMIT")
+
+        # Each shard keeps its own state files and its own sessions
+        self.LEDGER_PATH = self.shard_path(self.LEDGER_PATH)
+        self.DEDUP_INDEX_PATH = self.shard_path(self.DEDUP_INDEX_PATH)
+        self.CATALOG_CACHE_PATH = self.shard_path(self.CATALOG_CACHE_PATH)
+        self.PROBE_CACHE_PATH = self.shard_path(self.PROBE_CACHE_PATH)
+        self.THUMB_CACHE_DIR = self.shard_path(self.THUMB_CACHE_DIR)
+        self.METRICS_PATH = self.shard_path(self.METRICS_PATH)
+        self.METRICS_PROM_PATH = self.shard_path(self.METRICS_PROM_PATH)
+        # Only the spooled copy of a remote catalog is per shard, a local one is shared
+        self.CATALOG_PATH = self.shard_path('media_data.json') if self.GOOGLE_DRIVE_JSON_URL else 'media_data.json'
+        if self.SHARD_COUNT > 1 and self.SESSION_STRINGS:
+            # Telegram revokes a session used from two places at once (AUTH_KEY_DUPLICATED)
+            if len(self.SESSION_STRINGS) < self.SHARD_COUNT:
+                self.errors.append(
+                    f"{self.SHARD_COUNT} shards need at least {self.SHARD_COUNT} session strings, "
+                    f"got {len(self.SESSION_STRINGS)}"
+                )
+            else:
+                self.SESSION_STRINGS = self.SESSION_STRINGS[self.SHARD_INDEX::self.SHARD_COUNT]
 
-async def download_json_data():
-    """Download JSON data from Google Drive or use local file"""
-    try:
-        if GOOGLE_DRIVE_JSON_URL:
-            logger.info(f"Downloading JSON data from Google Drive...")
+    def text(self, name, default=''):
+        return self.environ.get(name) or default
+
+    def integer(self, name, default, minimum=0):
+        value = self.environ.get(name)
+        if not value:
+            return default
+        try:
+            number = int(value)
+        except ValueError:
+            self.errors.append(f"{name} must be an integer, got {value!r}")
+            return default
+        if number < minimum:
+            self.errors.append(f"{name} must be at least {minimum}, got {number}")
+            return default
+        return number
+
+    def number(self, name, default, minimum=0):
+        value = self.environ.get(name)
+        if not value:
+            return default
+        try:
+            number = float(value)
+        except ValueError:
+            self.errors.append(f"{name} must be a number, got {value!r}")
+            return default
+        if number < minimum:
+            self.errors.append(f"{name} must be at least {minimum}, got {number}")
+            return default
+        return number
+
+    def flag(self, name, default=False):
+        value = (self.environ.get(name) or '').strip().lower()
+        if not value:
+            return default
+        if value in ('1', 'true', 'yes'):
+            return True
+        if value in ('0', 'false', 'no'):
+            return False
+        self.errors.append(f"{name} must be one of 1, 0, true, false, yes, no, got {self.environ[name]!r}")
+        return default
+
+    def choice(self, name, default, choices):
+        value = self.environ.get(name) or default
+        if value not in choices:
+            self.errors.append(f"{name} must be one of {', '.join(choices)}, got {value!r}")
+            return default
+        return value
+
+    def shard_path(self, path):
+        """Per-shard variant of a state file or directory path, so shards never share one"""
+        if self.SHARD_COUNT <= 1 or not path:
+            return path
+        root, extension = os.path.splitext(path)
+        return f"{root}.shard{self.SHARD_INDEX}{extension}"
+
+    def check(self, credentials=True):
+        """Raise ConfigError listing every invalid setting, and the missing credentials if they are needed"""
+        errors = list(self.errors)
+        if credentials:
+            if not self.API_ID:
+                errors.append("API_ID is not set")
+            if not self.API_HASH:
+                errors.append("API_HASH is not set")
+            if not self.SESSION_STRINGS:
+                errors.append("SESSION_STRING or SESSION_STRINGS is not set")
+        if errors:
+            raise ConfigError("Invalid configuration:\n  " + "\n  ".join(errors))
+
+config = Config()
+
+_http_session = None
+_http_session_loop = None
+
+def get_http_session():
+    """Return the process-wide aiohttp session, creating it on first use
+
+    All HTTP work shares one connection pool with per-host limits, DNS caching
+    and keep-alive reuse. A new session is created if the previous one was
+    closed or belongs to another event loop.
+    """
+    import aiohttp
+    global _http_session, _http_session_loop
+    loop = asyncio.get_running_loop()
+    if _http_session is None or _http_session.closed or _http_session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=config.HTTP_POOL_LIMIT,
+            limit_per_host=config.HTTP_PER_HOST_LIMIT,
+            ttl_dns_cache=300,
+            use_dns_cache=True,
+            keepalive_timeout=30,
+            enable_cleanup_closed=True
+        )
+        _http_session = aiohttp.ClientSession(connector=connector)
+        _http_session_loop = loop
+    return _http_session
+
+async def close_http_session():
+    """Close the shared HTTP session"""
+    global _http_session
+    if _http_session and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+def write_atomic(path, data):
+    """Replace a file with ``data`` (str or bytes) through a temp file, so a crash never leaves half of it"""
+    temp_path = f"{path}.tmp"
+    if isinstance(data, bytes):
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+    else:
+        with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+            f.write(data)
+    os.replace(temp_path, path)
+
+class RunMetrics:
+    """Per-stage and per-entry timings, byte counts, retries and FloodWait time of a run"""
+
+    STAGES = ('catalog', 'head', 'thumbnail', 'download', 'split', 'upload', 'cleanup')
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.stages = {}
+        self.counters = {'retries': 0, 'flood_waits': 0, 'flood_wait_seconds': 0.0}
+        self.entries = {}
+
+    def entry(self, entry_id=None):
+        """Metrics record of an entry, or None outside of one"""
+        if entry_id is None:
+            entry_id = current_entry.get()
+        if entry_id is None:
+            return None
+        return self.entries.setdefault(str(entry_id), {
+            'seconds': {}, 'bytes': {}, 'retries': 0, 'flood_wait_seconds': 0.0, 'result': None,
+            'started': time.time(), 'latency': None
+        })
+
+    def add(self, stage, seconds=0.0, nbytes=0, entry_id=None, count=0):
+        """Add time and bytes to a stage and to the entry it ran for"""
+        totals = self.stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'bytes': 0})
+        totals['count'] += count
+        totals['seconds'] += seconds
+        totals['bytes'] += nbytes
+
+        record = self.entry(entry_id)
+        if record is not None:
+            record['seconds'][stage] = record['seconds'].get(stage, 0.0) + seconds
+            if nbytes:
+                record['bytes'][stage] = record['bytes'].get(stage, 0) + nbytes
+
+    @contextlib.contextmanager
+    def stage(self, stage, entry_id=None):
+        """Time a block as one run of a stage; bytes can be set on the yielded dict"""
+        measured = {'bytes': 0}
+        started = time.monotonic()
+        try:
+            yield measured
+        finally:
+            self.add(stage, time.monotonic() - started, measured['bytes'], entry_id, count=1)
+
+    def retry(self):
+        """Count a retried download or upload attempt"""
+        self.counters['retries'] += 1
+        record = self.entry()
+        if record is not None:
+            record['retries'] += 1
+
+    def flood_wait(self, seconds):
+        """Count time spent waiting out a FloodWait"""
+        self.counters['flood_waits'] += 1
+        self.counters['flood_wait_seconds'] += seconds
+        record = self.entry()
+        if record is not None:
+            record['flood_wait_seconds'] += seconds
+
+    def finish_entry(self, entry_id, success):
+        """Record an entry's result and its latency since it was first measured"""
+        record = self.entry(entry_id)
+        record['result'] = 'done' if success else 'failed'
+        record['latency'] = time.time() - record['started']
+
+    def report(self):
+        """Run summary as a JSON-serialisable dict"""
+        duration = (self.finished or time.time()) - self.started
+        stages = {}
+        for stage, totals in self.stages.items():
+            stages[stage] = dict(totals, bytes_per_second=totals['bytes'] / totals['seconds'] if totals['seconds'] else 0.0)
+
+        return {
+            'started': self.started,
+            'duration': duration,
+            'stages': stages,
+            'counters': dict(self.counters),
+            'entries': [{'id': entry_id, **record} for entry_id, record in self.entries.items()]
+        }
+
+    @classmethod
+    def from_reports(cls, reports):
+        """Combine the reports of shards that ran side by side into one run"""
+        metrics = cls()
+        metrics.started = min(report['started'] for report in reports)
+        metrics.finished = max(report['started'] + report['duration'] for report in reports)
+        for report in reports:
+            for stage, totals in report['stages'].items():
+                metrics.add(stage, totals['seconds'], totals['bytes'], count=totals['count'])
+            for key, value in report['counters'].items():
+                metrics.counters[key] = metrics.counters.get(key, 0) + value
+            for record in report['entries']:
+                metrics.entries[record['id']] = {key: value for key, value in record.items() if key != 'id'}
+        return metrics
+
+    def write_report(self, path):
+        """Write the run report as CSV (one row per entry) or JSON, chosen by extension"""
+        report = self.report()
+        if path.endswith('.csv'):
+            stages = [stage for stage in self.STAGES if stage != 'catalog']
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(
+                ['id', 'result', 'latency_seconds'] + [f"{stage}_seconds" for stage in stages]
+                + ['download_bytes', 'upload_bytes', 'retries', 'flood_wait_seconds']
+            )
+            for record in report['entries']:
+                writer.writerow(
+                    [record['id'], record['result'] or '', f"{record['latency'] or 0.0:.3f}"]
+                    + [f"{record['seconds'].get(stage, 0.0):.3f}" for stage in stages]
+                    + [record['bytes'].get('download', 0), record['bytes'].get('upload', 0),
+                       record['retries'], f"{record['flood_wait_seconds']:.1f}"]
+                )
+            write_atomic(path, output.getvalue())
+        else:
+            write_atomic(path, json.dumps(report, indent=2))
+
+    def write_prometheus(self, path):
+        """Write the run totals in the Prometheus text format, e.g. for node_exporter's textfile collector"""
+        report = self.report()
+        lines = [
+            '# TYPE media_uploader_run_duration_seconds gauge',
+            f"media_uploader_run_duration_seconds {report['duration']:.3f}"
+        ]
+        for name, key in (('seconds', 'seconds'), ('bytes', 'bytes'), ('runs', 'count')):
+            lines.append(f"# TYPE media_uploader_stage_{name}_total counter")
+            for stage, totals in report['stages'].items():
+                lines.append(f'media_uploader_stage_{name}_total{{stage="{stage}"}} {totals[key]}')
+
+        lines += [
+            '# TYPE media_uploader_retries_total counter',
+            f"media_uploader_retries_total {self.counters['retries']}",
+            '# TYPE media_uploader_flood_waits_total counter',
+            f"media_uploader_flood_waits_total {self.counters['flood_waits']}",
+            '# TYPE media_uploader_flood_wait_seconds_total counter',
+            f"media_uploader_flood_wait_seconds_total {self.counters['flood_wait_seconds']}",
+            '# TYPE media_uploader_entries_total counter'
+        ]
+        for result in ('done', 'failed'):
+            count = sum(1 for record in report['entries'] if record['result'] == result)
+            lines.append(f'media_uploader_entries_total{{result="{result}"}} {count}')
+
+        write_atomic(path, '\n'.join(lines) + '\n')
+
+current_entry = contextvars.ContextVar('current_entry', default=None)
+_metrics = RunMetrics()
+
+def get_metrics():
+    """Return the metrics of the current run"""
+    return _metrics
+
+def reset_metrics():
+    """Start a new run's metrics and return them"""
+    global _metrics
+    _metrics = RunMetrics()
+    return _metrics
+
+class CatalogCache:
+    """HTTP validators and per-entry fingerprints of the last processed catalog"""
+
+    def __init__(self, path):
+        self.path = path
+        self.url = None
+        self.etag = None
+        self.last_modified = None
+        self.fingerprints = {}
+        self.seen = {}
+        self.delta = set()
+        self.adopted = set()
+
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+                self.url = data.get('url')
+                self.etag = data.get('etag')
+                self.last_modified = data.get('last_modified')
+                self.fingerprints = data.get('fingerprints', {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable catalog cache {path}: {e}")
+
+    def request_headers(self, url):
+        """Conditional request headers, if the cached catalog is still on disk"""
+        headers = {}
+        if url == self.url and os.path.exists(config.CATALOG_PATH):
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def observe(self, entry):
+        """Fingerprint a parsed entry and note whether it is new or changed"""
+        entry_id = str(entry['id'])
+        fingerprint = hashlib.sha1(json.dumps(entry, sort_keys=True).encode()).hexdigest()
+        self.seen[entry_id] = fingerprint
+        if self.fingerprints.get(entry_id) != fingerprint:
+            self.delta.add(entry_id)
+
+    def is_changed(self, entry_id):
+        return str(entry_id) in self.delta
+
+    def is_modified(self, entry_id):
+        """Whether the entry has a stored fingerprint that no longer matches"""
+        entry_id = str(entry_id)
+        return entry_id in self.fingerprints and entry_id in self.delta
+
+    def adopt(self, entry_id):
+        """Take the fingerprint just seen as the baseline without processing the entry"""
+        self.adopted.add(str(entry_id))
+
+    def update_validators(self, url, headers):
+        self.url = url
+        self.etag = headers.get('ETag')
+        self.last_modified = headers.get('Last-Modified')
+
+    def save(self, done=()):
+        """Persist validators and the fingerprints of the entries processed so far
+
+        Only the entries in ``done`` and the adopted ones move to the
+        fingerprint just seen. Every other entry keeps its previous
+        fingerprint, or none, so entries that failed or were never selected
+        still count as changed next run. Entries gone from the catalog are
+        dropped.
+        """
+        done = {str(entry_id) for entry_id in done} | self.adopted
+        fingerprints = {
+            entry_id: fingerprint if entry_id in done else self.fingerprints[entry_id]
+            for entry_id, fingerprint in self.seen.items()
+            if entry_id in done or entry_id in self.fingerprints
+        }
+        write_atomic(self.path, json.dumps({
+            'url': self.url,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'fingerprints': fingerprints
+        }))
+
+async def iter_json_array(chunks):
+    """Incrementally parse a JSON array from byte chunks, yielding one element at a time"""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer = ''
+    position = 0
+    started = False
+    finished = False
+
+    async def more():
+        nonlocal buffer, position, finished
+        async for chunk in chunk_iter:
+            text = utf8.decode(chunk)
+            if text:
+                buffer = buffer[position:] + text
+                position = 0
+                return True
+        buffer = buffer[position:] + utf8.decode(b'', final=True)
+        position = 0
+        finished = True
+        return False
 
-            # Convert sharing URL to direct download URL if needed
-            download_url = convert_google_drive_url(GOOGLE_DRIVE_JSON_URL)
+    chunk_iter = chunks.__aiter__()
+    while True:
+        # Skip whitespace and separators between elements
+        while position < len(buffer) and buffer[position] in ' \t\r\n' + (',' if started else ''):
+            position += 1
+        if position >= len(buffer):
+            if finished:
+                raise ValueError("Catalog ended before the closing bracket")
+            await more()
+            continue
+
+        if not started:
+            if buffer[position] != '[':
+                raise ValueError("Catalog is not a JSON array")
+            started = True
+            position += 1
+            continue
+
+        if buffer[position] == ']':
+            return
+
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The element is cut off at the end of the buffer
+            if finished:
+                raise
+            await more()
+            continue
+
+        # A scalar is only complete once a delimiter follows it, since the next
+        # chunk may continue it (1 then .5, 1e then 5, tr then ue)
+        if not finished and not isinstance(element, (dict, list)):
+            if end == len(buffer) or buffer[end] not in ' \t\r\n,]':
+                await more()
+                continue
+
+        position = end
+        yield element
+
+async def read_file_chunks(path, chunk_size=64 * 1024):
+    """Yield a local file in chunks"""
+    import aiofiles
+    async with aiofiles.open(path, 'rb') as f:
+        while True:
+            chunk = await f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+async def spool_catalog(url, path, state, event, cache=None):
+    """Download the catalog to path at full speed, signalling event as data lands"""
+    import aiofiles
+    from aiohttp import ClientTimeout
+    temp_path = f"{path}.part"
+    try:
+        timeout = ClientTimeout(total=60 * 10, sock_read=60)
+        headers = cache.request_headers(url) if cache else {}
+        session = get_http_session()
+        async with session.get(url, headers=headers, timeout=timeout) as response:
+            if response.status == 304:
+                logger.info("Catalog not modified since the last run, using the cached copy")
+                state['not_modified'] = True
+                return
 
-            response = requests.get(download_url, timeout=60)
             response.raise_for_status()
+            if cache:
+                cache.update_validators(url, response.headers)
+
+            async with aiofiles.open(temp_path, 'wb') as f:
+                # The follower may only open the spool once this run has created it
+                state['opened'] = True
+                event.set()
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    await f.write(chunk)
+                    await f.flush()
+                    state['written'] += len(chunk)
+                    event.set()
 
-            # Save downloaded data to local file
-            with open('media_data.json', 'w') as f:
-                f.write(response.text)
+        os.replace(temp_path, path)
+    except Exception as e:
+        state['error'] = e
+    finally:
+        state['done'] = True
+        event.set()
 
-            # Parse and return JSON data
-            media_data = json.loads(response.text)
-            logger.info(f"Successfully downloaded {len(media_data)} entries from Google Drive")
-            return media_data
-        else:
-            # Use local file
-            logger.info("Using local media_data.json file")
-            with open('media_data.json', 'r') as f:
-                media_data = json.load(f)
-            logger.info(f"Loaded {len(media_data)} entries from local file")
-            return media_data
+async def follow_spool(path, state, event, chunk_size=64 * 1024):
+    """Yield chunks of a file that is still being written by spool_catalog"""
+    import aiofiles
+    temp_path = f"{path}.part"
+    position = 0
+
+    while not state.get('opened') and not state['done']:
+        event.clear()
+        await event.wait()
+
+    if state['error']:
+        raise state['error']
 
+    if state.get('not_modified'):
+        async for chunk in read_file_chunks(path, chunk_size):
+            yield chunk
+        return
+
+    try:
+        f = await aiofiles.open(temp_path, 'rb')
+    except FileNotFoundError:
+        # The spool already finished and was moved into place
+        f = await aiofiles.open(path, 'rb')
+
+    try:
+        while True:
+            chunk = await f.read(chunk_size)
+            if chunk:
+                position += len(chunk)
+                yield chunk
+                continue
+
+            if state['error']:
+                raise state['error']
+            if state['done'] and position >= state['written']:
+                return
+
+            event.clear()
+            if state['written'] <= position and not state['done']:
+                await event.wait()
+    finally:
+        await f.close()
+
+async def stream_catalog(start_from_id=None, cache=None):
+    """Stream catalog entries from Google Drive or the local file as they are parsed
+
+    The remote catalog is spooled to media_data.json without waiting for the
+    consumer, while entries are parsed from the spooled bytes one at a time, so
+    the first upload can start before the download finishes and memory stays
+    flat regardless of catalog size. With a CatalogCache the download is a
+    conditional request and every entry is fingerprinted for delta detection.
+    """
+    task = None
+    if config.GOOGLE_DRIVE_JSON_URL:
+        logger.info(f"Streaming JSON data from Google Drive...")
+
+        # Convert sharing URL to direct download URL if needed
+        download_url = convert_google_drive_url(config.GOOGLE_DRIVE_JSON_URL)
+
+        # A spool left behind by a crashed run must never be mistaken for this one
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(f"{config.CATALOG_PATH}.part")
+
+        state = {'written': 0, 'opened': False, 'done': False, 'error': None}
+        event = asyncio.Event()
+        task = asyncio.create_task(spool_catalog(download_url, config.CATALOG_PATH, state, event, cache))
+        chunks = follow_spool(config.CATALOG_PATH, state, event)
+    else:
+        # Use local file
+        logger.info(f"Streaming local {config.CATALOG_PATH} file")
+        chunks = read_file_chunks(config.CATALOG_PATH)
+
+    count = 0
+    # Time suspended at yield belongs to the consumer, not to loading the catalog
+    elapsed = 0.0
+    resumed = time.monotonic()
+    try:
+        async for entry in iter_json_array(chunks):
+            count += 1
+            if cache:
+                cache.observe(entry)
+            if start_from_id is None or entry['id'] >= start_from_id:
+                elapsed += time.monotonic() - resumed
+                yield entry
+                resumed = time.monotonic()
+
+        # Let the spool finish so media_data.json is complete
+        if task:
+            await task
+            if state['error']:
+                raise state['error']
     except Exception as e:
         logger.error(f"Error loading JSON data: {e}")
         raise
+    finally:
+        if task and not task.done():
+            task.cancel()
 
-async def get_file_size(url, session=None):
-    """Get file size from URL without downloading"""
-    close_session = False
-    if session is None:
-        session = aiohttp.ClientSession()
-        close_session = True
+    logger.info(f"Parsed {count} catalog entries")
+    catalog_size = os.path.getsize(config.CATALOG_PATH) if os.path.exists(config.CATALOG_PATH) else 0
+    elapsed += time.monotonic() - resumed
+    get_metrics().add('catalog', elapsed, catalog_size, count=1)
+    if cache:
+        logger.info(f"{len(cache.delta)} new or changed entries since the last run")
+
+async def download_json_data():
+    """Download JSON data from Google Drive or use local file"""
+    media_data = [entry async for entry in stream_catalog()]
+    logger.info(f"Loaded {len(media_data)} entries")
+    return media_data
 
+async def resolve_url(url, session=None):
+    """Direct download URL of a catalog link, or the link itself if it cannot be resolved"""
+    from aiohttp import ClientTimeout
+    try:
+        return await resolve_download_url(session or get_http_session(), url, ClientTimeout(total=30, connect=10))
+    except Exception as e:
+        logger.warning(f"Could not resolve download URL for {url}: {e}")
+        return convert_google_drive_url(url)
+
+async def probe_file(url, session=None):
+    """Get file size and Range support from URL without downloading"""
+    from aiohttp import ClientTimeout
+    session = session or get_http_session()
+
+    info = {'size': 0, 'accept_ranges': False, 'status': None}
     try:
         timeout = ClientTimeout(total=30, connect=10)
-        async with session.head(url, timeout=timeout, allow_redirects=True) as response:
-            if response.status == 200:
-                size = response.headers.get('content-length')
-                return int(size) if size else 0
-            else:
-                logger.warning(f"HEAD request failed with status {response.status} for {url}")
-                return 0
+        url = await resolve_url(url, session)
+        with get_metrics().stage('head'):
+            async with session.head(url, timeout=timeout, allow_redirects=True) as response:
+                info['status'] = response.status
+                if response.status == 200:
+                    size = response.headers.get('content-length')
+                    info['size'] = int(size) if size else 0
+                    info['accept_ranges'] = response.headers.get('accept-ranges', '').lower() == 'bytes'
+                else:
+                    logger.warning(f"HEAD request failed with status {response.status} for {url}")
     except Exception as e:
         logger.warning(f"Could not get file size for {url}: {e}")
-        return 0
-    finally:
-        if close_session:
-            await session.close()
+
+    return info
+
+async def get_file_size(url, session=None):
+    """Get file size from URL without downloading"""
+    info = await probe_file(url, session)
+    return info['size']
+
+def is_dead_link(file_info):
+    """Whether a probe shows the link is gone rather than temporarily failing"""
+    status = file_info['status']
+    return status is not None and 400 <= status < 500 and status not in (405, 429)
+
+class ProbeCache:
+    """HEAD probe results per URL, each valid for PROBE_CACHE_TTL seconds"""
+
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = config.PROBE_CACHE_TTL if ttl is None else ttl
+        self.probes = {}
+
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self.probes = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable probe cache {path}: {e}")
+
+    def get(self, url):
+        """Cached probe of a URL, if it has not expired"""
+        probe = self.probes.get(url)
+        if probe and time.time() - probe['checked'] < self.ttl:
+            return {key: probe[key] for key in ('size', 'accept_ranges', 'status')}
+        return None
+
+    def put(self, url, file_info):
+        # Failed requests say nothing about the link
+        if file_info['status'] is not None:
+            self.probes[url] = dict(file_info, checked=time.time())
+
+    def save(self):
+        """Persist unexpired probes"""
+        now = time.time()
+        write_atomic(self.path, json.dumps(
+            {url: probe for url, probe in self.probes.items() if now - probe['checked'] < self.ttl}
+        ))
+
+async def preflight_entries(entries, cache=None, ledger=None):
+    """HEAD-probe every entry concurrently, drop dead links and order the rest
+
+    Returns the entries to process and their probes by entry ID. Entries
+    whose links answer with a client error are marked failed in the ledger
+    and left out. With PREFLIGHT_ORDER=size the rest are sorted smallest
+    first, unknown sizes last, so short uploads are not stuck behind long
+    ones; otherwise catalog order is kept.
+    """
+    probes = {}
+    pending = iter(entries)
+    cached = 0
+
+    async def probe_worker():
+        nonlocal cached
+        # Workers share one iterator, so each entry is probed once
+        for entry in pending:
+            file_info = cache.get(entry['link']) if cache else None
+            if file_info:
+                cached += 1
+            else:
+                file_info = await probe_file(entry['link'])
+                if cache:
+                    cache.put(entry['link'], file_info)
+            probes[entry['id']] = file_info
+
+    started = time.monotonic()
+    await asyncio.gather(*(probe_worker() for _ in range(max(1, config.PREFLIGHT_CONCURRENCY))))
+
+    alive = []
+    for entry in entries:
+        file_info = probes[entry['id']]
+        if is_dead_link(file_info):
+            logger.warning(f"Dropping ID {entry['id']}: link answered HTTP {file_info['status']}")
+            get_metrics().finish_entry(entry['id'], False)
+            if ledger:
+                ledger.update(entry['id'], state='failed', error=f"HTTP {file_info['status']}")
+            continue
+        alive.append(entry)
+
+    if config.PREFLIGHT_ORDER == 'size':
+        alive.sort(key=lambda entry: (probes[entry['id']]['size'] <= 0, probes[entry['id']]['size']))
+
+    logger.info(
+        f"Preflight probed {len(entries)} entries in {time.monotonic() - started:.1f}s "
+        f"({cached} cached), {len(entries) - len(alive)} dead, "
+        f"{sum(probes[entry['id']]['size'] for entry in alive) / 1024 ** 3:.2f} GB to process"
+    )
+    if cache:
+        cache.save()
+    return alive, probes
+
+class RangeNotSupported(Exception):
+    """Raised when a server answers a Range request with the full body"""
+
+class SizeChanged(Exception):
+    """Raised when a ranged response reports another total size than the download planned with"""
+
+    def __init__(self, size):
+        super().__init__(f"server reports {size} bytes")
+        self.size = size
 
 def get_clean_filename(name, url):
     """Generate clean filename from name and URL"""
@@ -110,14 +852,83 @@ def get_clean_filename(name, url):
 
     return f"{clean_name}{extension}"
 
-async def download_with_resume(session, url, file_path, start_byte=0):
-    """Download file with resume capability"""
+class CoalescingWriter:
+    """Async file writer that gathers network chunks into large aligned pwrites in the executor"""
+
+    def __init__(self, path, offset=0, truncate=False):
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if truncate else 0)
+        self.fd = os.open(path, flags, 0o644)
+        self.offset = offset
+        self.buffer = bytearray()
+        self.pending = None
+        self.received = 0
+        self.started = time.monotonic()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def target(self):
+        """Buffer size to write at, following the bandwidth seen so far"""
+        elapsed = time.monotonic() - self.started
+        rate = self.received / elapsed if elapsed > 0 else 0
+        size = min(config.WRITE_BUFFER_MAX, max(config.WRITE_BUFFER_MIN, int(rate * WRITE_BUFFER_SECONDS)))
+        return max(WRITE_ALIGN, size - size % WRITE_ALIGN)
+
+    def _pwrite(self, data, offset):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    async def _drain(self, everything):
+        length = len(self.buffer)
+        if not everything:
+            # Keep the tail past the last aligned offset for the next write
+            length -= (self.offset + length) % WRITE_ALIGN
+        if length <= 0:
+            return
+
+        data = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        if self.pending:
+            await self.pending
+        self.pending = asyncio.get_running_loop().run_in_executor(None, self._pwrite, data, self.offset)
+        self.offset += length
+
+    async def write(self, chunk):
+        self.buffer += chunk
+        self.received += len(chunk)
+        if len(self.buffer) >= self.target():
+            await self._drain(everything=False)
+
+    async def flush(self):
+        await self._drain(everything=True)
+        if self.pending:
+            pending, self.pending = self.pending, None
+            await pending
+
+    async def close(self):
+        if self.fd is None:
+            return
+        try:
+            await self.flush()
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+async def download_with_resume(session, url, file_path, start_byte=0, checkpoint=None, hasher=None):
+    """Download file with resume capability, feeding written bytes to an optional hasher"""
+    from aiohttp import ClientError, ClientTimeout
     headers = {}
     if start_byte > 0:
         headers['Range'] = f'bytes={start_byte}-'
         logger.info(f"Resuming download from byte {start_byte}")
 
-    timeout = ClientTimeout(total=DOWNLOAD_TIMEOUT, sock_read=300)  # 5 min read timeout
+    timeout = ClientTimeout(total=config.DOWNLOAD_TIMEOUT, sock_read=300)  # 5 min read timeout
 
     try:
         async with session.get(url, headers=headers, timeout=timeout) as response:
@@ -125,19 +936,28 @@ async def download_with_resume(session, url, file_path, start_byte=0):
                 logger.error(f"HTTP {response.status} for {url}")
                 return False
 
-            # Open file in append mode if resuming
-            mode = 'ab' if start_byte > 0 else 'wb'
-            async with aiofiles.open(file_path, mode) as f:
+            # Continue after the bytes on disk if resuming
+            async with CoalescingWriter(file_path, start_byte, truncate=start_byte == 0) as f:
                 downloaded = start_byte
-                chunk_size = 8192
+                synced = start_byte
+                logged = start_byte
 
-                async for chunk in response.content.iter_chunked(chunk_size):
+                async for chunk in response.content.iter_any():
                     await f.write(chunk)
                     downloaded += len(chunk)
+                    if hasher:
+                        hasher.update(chunk)
 
                     # Log progress every 10MB
-                    if downloaded % (10 * 1024 * 1024) == 0:
+                    if downloaded - logged >= 10 * 1024 * 1024:
                         logger.info(f"Downloaded: {downloaded / 1024 / 1024:.1f} MB")
+                        logged = downloaded
+
+                    # Checkpoint flushed progress so a restart can resume here
+                    if checkpoint and downloaded - synced >= config.LEDGER_SYNC_BYTES:
+                        await f.flush()
+                        checkpoint.update(downloaded=downloaded)
+                        synced = downloaded
 
                 return True
 
@@ -151,86 +971,404 @@ async def download_with_resume(session, url, file_path, start_byte=0):
         logger.error(f"Unexpected error during download: {e}")
         return False
 
-async def download_file(url, filename):
-    """Download file from URL with retry logic and resume capability"""
-    logger.info(f"Starting download: {filename}")
+async def download_range(session, url, file_path, start, end, progress, on_sync=None, file_size=None):
+    """Download bytes start..end (inclusive) into file_path at their offset
+
+    ``progress`` is a two-item list holding the bytes of this range received
+    and the bytes flushed to disk, so a retry continues after the last flush.
+    ``on_sync`` is called whenever another LEDGER_SYNC_BYTES have been flushed.
+    Raises SizeChanged when the Content-Range total differs from ``file_size``.
+    """
+    from aiohttp import ClientError, ClientTimeout
+    progress[0] = progress[1]
+    headers = {'Range': f'bytes={start + progress[0]}-{end}'}
+    timeout = ClientTimeout(total=config.DOWNLOAD_TIMEOUT, sock_read=300)  # 5 min read timeout
+
+    async with session.get(url, headers=headers, timeout=timeout) as response:
+        # A full 200 response means the Range header was ignored, other errors are worth a retry
+        if response.status == 200:
+            raise RangeNotSupported(f"HTTP {response.status} for ranged request")
+        if response.status != 206:
+            raise ClientError(f"HTTP {response.status} for range {start}-{end}")
+        # A probe can be hours old, and a file that grew would otherwise be cut off silently
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        if file_size is not None and total.isdigit() and int(total) != file_size:
+            raise SizeChanged(int(total))
+
+        async with CoalescingWriter(file_path, start + progress[0]) as f:
+            try:
+                async for chunk in response.content.iter_any():
+                    chunk = chunk[:end - start + 1 - progress[0]]
+                    await f.write(chunk)
+                    progress[0] += len(chunk)
+
+                    if on_sync and progress[0] - progress[1] >= config.LEDGER_SYNC_BYTES:
+                        await f.flush()
+                        progress[1] = progress[0]
+                        on_sync()
+            finally:
+                # Only bytes that reached the file count as flushed
+                await f.flush()
+                progress[1] = progress[0]
+
+    if progress[0] < end - start + 1:
+        raise ClientError(f"Range {start}-{end} ended after {progress[0]} bytes")
+
+async def download_ranged(session, url, file_path, file_size, connections, checkpoint=None):
+    """Download file over several parallel ranged connections into a preallocated file
+
+    Returns whether every range completed. Raises RangeNotSupported when the
+    server ignores Range requests and SizeChanged when the file is no longer
+    ``file_size`` bytes.
+    """
+    range_size = math.ceil(file_size / connections)
+    ranges = [(start, min(start + range_size, file_size) - 1) for start in range(0, file_size, range_size)]
+    progresses = [[0, 0] for _ in ranges]
+
+    # Pick up the ranges of an interrupted run if its file is still around
+    saved = checkpoint.get('ranges') if checkpoint else None
+    if (saved and [tuple(r[:2]) for r in saved] == ranges
+            and os.path.exists(file_path) and os.path.getsize(file_path) == file_size):
+        progresses = [[r[2], r[2]] for r in saved]
+        logger.info(f"Resuming ranged download at {sum(r[2] for r in saved) / 1024 / 1024:.1f} MB")
+    else:
+        # Preallocate so every range can be written at its offset
+        with open(file_path, 'wb') as f:
+            f.truncate(file_size)
+
+    logger.info(f"Downloading in {len(ranges)} ranges of ~{range_size / 1024 / 1024:.1f} MB")
+
+    def sync_ranges():
+        # Sibling ranges may still buffer bytes, so only their flushed offsets are checkpointed
+        if checkpoint:
+            checkpoint.update(
+                ranges=[[start, end, progress[1]] for (start, end), progress in zip(ranges, progresses)],
+                downloaded=sum(progress[1] for progress in progresses)
+            )
 
-    # Create temporary file
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1])
-    temp_path = temp_file.name
-    temp_file.close()
-
-    connector = aiohttp.TCPConnector(
-        limit=10,
-        ttl_dns_cache=300,
-        use_dns_cache=True,
-        keepalive_timeout=30,
-        enable_cleanup_closed=True
-    )
+    async def fetch(index, start, end):
+        progress = progresses[index]
+        if progress[1] > end - start:
+            return True
 
-    async with aiohttp.ClientSession(connector=connector) as session:
-        # Check file size first
-        file_size = await get_file_size(url, session)
-        if file_size > TELEGRAM_LIMIT * 10:  # Don't download extremely large files (>20GB)
-            logger.error(f"File too large to process: {file_size / 1024 / 1024 / 1024:.1f} GB")
+        for attempt in range(config.MAX_RETRIES):
             try:
-                os.unlink(temp_path)
-            except:
-                pass
-            return None
+                await download_range(session, url, file_path, start, end, progress, sync_ranges, file_size)
+                sync_ranges()
+                return True
+            except (RangeNotSupported, SizeChanged):
+                raise
+            except Exception as e:
+                logger.warning(f"Range {index + 1}/{len(ranges)} attempt {attempt + 1} failed: {e}")
+                # A later attempt or run continues from the last flushed byte
+                sync_ranges()
 
-        if file_size > 0:
-            logger.info(f"File size: {file_size / 1024 / 1024:.1f} MB")
+            if attempt < config.MAX_RETRIES - 1:
+                get_metrics().retry()
+                await asyncio.sleep(2 ** attempt)
 
-        # Retry logic
-        for attempt in range(MAX_RETRIES):
-            try:
-                logger.info(f"Download attempt {attempt + 1}/{MAX_RETRIES}")
-
-                # Check if partial file exists
-                start_byte = 0
-                if os.path.exists(temp_path) and attempt > 0:
-                    start_byte = os.path.getsize(temp_path)
-                    if start_byte > 0:
-                        logger.info(f"Found partial download, resuming from {start_byte / 1024 / 1024:.1f} MB")
-
-                # Attempt download
-                success = await download_with_resume(session, url, temp_path, start_byte)
-
-                if success:
-                    final_size = os.path.getsize(temp_path)
-                    logger.info(f"Download completed: {filename} ({final_size / 1024 / 1024:.1f} MB)")
-
-                    # Verify file size if we know the expected size
-                    if file_size > 0 and abs(final_size - file_size) > 1024:  # Allow 1KB difference
-                        logger.warning(f"File size mismatch: expected {file_size}, got {final_size}")
-                        if attempt < MAX_RETRIES - 1:
-                            logger.info("Retrying download due to size mismatch")
-                            continue
-
-                    return temp_path
-                else:
-                    logger.warning(f"Download attempt {attempt + 1} failed")
+        logger.error(f"Range {index + 1}/{len(ranges)} failed after {config.MAX_RETRIES} attempts")
+        return False
 
-            except Exception as e:
-                logger.error(f"Download attempt {attempt + 1} failed with error: {e}")
+    tasks = [asyncio.create_task(fetch(i, start, end)) for i, (start, end) in enumerate(ranges)]
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return all(results)
+
+def hash_file(path):
+    """SHA-256 of a file on disk"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+async def fill_digest(digest, temp_path, hasher=None):
+    """Store the content hash of a finished download in ``digest``"""
+    if digest is None:
+        return
+    if hasher:
+        digest['sha256'] = hasher.hexdigest()
+    else:
+        # Resumed or ranged downloads were not hashed in order, read the file back
+        digest['sha256'] = await asyncio.get_running_loop().run_in_executor(None, hash_file, temp_path)
+
+async def download_file(url, filename, checkpoint=None, digest=None, file_info=None):
+    """Download file from URL with retry logic and resume capability
+
+    With a ledger ``checkpoint`` the temp path and download progress are
+    recorded, so an interrupted download continues from its last checkpoint.
+    If a ``digest`` dict is passed, the SHA-256 of the content is stored in it.
+    A ``file_info`` from an earlier probe_file() saves the HEAD request.
+    """
+    logger.info(f"Starting download: {filename}")
 
-            # Wait before retry (exponential backoff)
-            if attempt < MAX_RETRIES - 1:
-                wait_time = 2 ** attempt  # 1, 2, 4 seconds
-                logger.info(f"Waiting {wait_time} seconds before retry...")
-                await asyncio.sleep(wait_time)
+    # Reuse the partial file of an interrupted run, or create a new one
+    temp_path = checkpoint.get('temp_path') if checkpoint else None
+    resuming = bool(temp_path and os.path.exists(temp_path))
+    if resuming and checkpoint.get('state') == 'downloaded':
+        logger.info(f"Reusing completed download: {temp_path}")
+        await fill_digest(digest, temp_path)
+        return temp_path
 
-        # All attempts failed
-        logger.error(f"All download attempts failed for {filename}")
+    if not resuming:
+        temp_file = tempfile.NamedTemporaryFile(
+            delete=False, prefix=TEMP_PREFIX, suffix=os.path.splitext(filename)[1], dir=get_temp_dir()
+        )
+        temp_path = temp_file.name
+        temp_file.close()
+
+    session = get_http_session()
+    url = await resolve_url(url, session)
+
+    # Check file size first
+    file_info = file_info or await probe_file(url, session)
+    file_size = file_info['size']
+    if file_size > config.TELEGRAM_LIMIT * 10:  # Don't download extremely large files (>20GB)
+        logger.error(f"File too large to process: {file_size / 1024 / 1024 / 1024:.1f} GB")
         try:
             os.unlink(temp_path)
         except:
             pass
         return None
 
+    if file_size > 0:
+        logger.info(f"File size: {file_size / 1024 / 1024:.1f} MB")
+
+    if checkpoint:
+        checkpoint.update(state='downloading', temp_path=temp_path, size=file_size)
+
+    # Split into parallel ranges when the server supports it
+    connections = min(config.DOWNLOAD_CONNECTIONS, file_size // config.MIN_RANGE_SIZE)
+    if file_info['accept_ranges'] and connections > 1:
+        try:
+            if await download_ranged(session, url, temp_path, file_size, connections, checkpoint):
+                logger.info(f"Download completed: {filename} ({file_size / 1024 / 1024:.1f} MB)")
+                if checkpoint:
+                    checkpoint.update(state='downloaded', downloaded=file_size, ranges=None)
+                await fill_digest(digest, temp_path)
+                return temp_path
+
+            # Completed ranges stay on disk and in the ledger for the next attempt to resume
+            logger.error(f"Ranged download failed for {filename}")
+            if checkpoint:
+                checkpoint.update(state='failed')
+            else:
+                with contextlib.suppress(OSError):
+                    os.unlink(temp_path)
+            return None
+        except RangeNotSupported as e:
+            logger.warning(f"Server ignored Range requests ({e}), falling back to a single connection")
+        except SizeChanged as e:
+            logger.warning(f"{filename} changed since it was probed ({file_size} bytes, {e}), starting over")
+            file_size = e.size
+
+        # Start over on a single connection
+        with open(temp_path, 'wb'):
+            pass
+        if checkpoint:
+            checkpoint.update(downloaded=0, ranges=None, size=file_size)
+        resuming = False
+    elif checkpoint and checkpoint.get('ranges'):
+        # A ranged layout cannot be continued as a single stream
+        with open(temp_path, 'wb'):
+            pass
+        checkpoint.update(downloaded=0, ranges=None)
+        resuming = False
+
+    # Retry logic
+    for attempt in range(config.MAX_RETRIES):
+        try:
+            logger.info(f"Download attempt {attempt + 1}/{config.MAX_RETRIES}")
+
+            # Check if partial file exists
+            start_byte = 0
+            if os.path.exists(temp_path) and (attempt > 0 or resuming):
+                start_byte = os.path.getsize(temp_path)
+                if start_byte > 0:
+                    logger.info(f"Found partial download, resuming from {start_byte / 1024 / 1024:.1f} MB")
+
+            # Hash while downloading, unless this attempt appends to earlier bytes
+            hasher = hashlib.sha256() if digest is not None and start_byte == 0 else None
+
+            # Attempt download
+            success = await download_with_resume(session, url, temp_path, start_byte, checkpoint, hasher)
+
+            if success:
+                final_size = os.path.getsize(temp_path)
+                logger.info(f"Download completed: {filename} ({final_size / 1024 / 1024:.1f} MB)")
+
+                # Verify file size if we know the expected size
+                if file_size > 0 and abs(final_size - file_size) > 1024:  # Allow 1KB difference
+                    logger.warning(f"File size mismatch: expected {file_size}, got {final_size}")
+                    if attempt < config.MAX_RETRIES - 1:
+                        logger.info("Retrying download due to size mismatch")
+                        get_metrics().retry()
+                        continue
+
+                if checkpoint:
+                    checkpoint.update(state='downloaded', downloaded=final_size)
+                await fill_digest(digest, temp_path, hasher)
+                return temp_path
+            else:
+                logger.warning(f"Download attempt {attempt + 1} failed")
+
+        except Exception as e:
+            logger.error(f"Download attempt {attempt + 1} failed with error: {e}")
+
+        # Wait before retry (exponential backoff)
+        if attempt < config.MAX_RETRIES - 1:
+            get_metrics().retry()
+            wait_time = 2 ** attempt  # 1, 2, 4 seconds
+            logger.info(f"Waiting {wait_time} seconds before retry...")
+            await asyncio.sleep(wait_time)
+
+    # All attempts failed
+    logger.error(f"All download attempts failed for {filename}")
+    try:
+        os.unlink(temp_path)
+    except:
+        pass
+    if checkpoint:
+        checkpoint.update(state='failed', temp_path=None, downloaded=0)
+    return None
+
+class FileRangeView(io.RawIOBase):
+    """Read-only, seekable window over a byte range of a file, read with os.pread"""
+
+    def __init__(self, path, offset, length, name=None):
+        super().__init__()
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.name = name or os.path.basename(path)
+        self._fd = os.open(path, os.O_RDONLY)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = self.length + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+
+        if position < 0:
+            raise ValueError("Negative seek position")
+
+        self._position = position
+        return position
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.length - self._position)
+        if size <= 0:
+            return 0
+
+        data = os.pread(self._fd, size, self.offset + self._position)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length - self._position
+        size = min(size, self.length - self._position)
+        if size <= 0:
+            return b''
+
+        data = os.pread(self._fd, size, self.offset + self._position)
+        self._position += len(data)
+        return data
+
+    def close(self):
+        if not self.closed:
+            os.close(self._fd)
+        super().close()
+
+def get_media_size(media):
+    """Return the size of a file path or FileRangeView"""
+    if isinstance(media, FileRangeView):
+        return media.length
+    return os.path.getsize(media)
+
+def split_file_views(file_path, chunk_size):
+    """Split large file into byte-range views without writing part files"""
+    try:
+        file_size = os.path.getsize(file_path)
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+        extension = os.path.splitext(file_path)[1]
+
+        num_parts = math.ceil(file_size / chunk_size)
+        logger.info(f"Splitting file into {num_parts} views of ~{chunk_size/1024/1024:.0f}MB each")
+
+        split_files = []
+        for part_num in range(1, num_parts + 1):
+            part_filename = f"{base_name}.part{part_num:03d}{extension}"
+            offset = (part_num - 1) * chunk_size
+            length = min(chunk_size, file_size - offset)
+            split_files.append((FileRangeView(file_path, offset, length, part_filename), part_filename))
+
+        return split_files
+
+    except Exception as e:
+        logger.error(f"Error splitting file: {e}")
+        return []
+
+def copy_range(source_path, dest_path, offset, length):
+    """Copy length bytes at offset of one file into a new file, inside the kernel where possible
+
+    copy_file_range can share extents on filesystems that support it;
+    sendfile and then a plain read/write loop are the fallbacks.
+    """
+    with open(source_path, 'rb') as source, open(dest_path, 'wb') as dest:
+        copied = 0
+        for kernel_copy in ('copy_file_range', 'sendfile'):
+            if not hasattr(os, kernel_copy):
+                continue
+            try:
+                while copied < length:
+                    if kernel_copy == 'copy_file_range':
+                        sent = os.copy_file_range(source.fileno(), dest.fileno(), length - copied,
+                                                  offset + copied, copied)
+                    else:
+                        dest.seek(copied)
+                        sent = os.sendfile(dest.fileno(), source.fileno(), offset + copied, length - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+                return copied
+            except OSError:
+                # Not supported between these files, try the next way
+                continue
+
+        source.seek(offset + copied)
+        dest.seek(copied)
+        buffer = bytearray(config.WRITE_BUFFER_MAX)
+        while copied < length:
+            read = source.readinto(memoryview(buffer)[:min(len(buffer), length - copied)])
+            if not read:
+                break
+            dest.write(memoryview(buffer)[:read])
+            copied += read
+        return copied
+
 async def split_file(file_path, chunk_size):
-    """Split large file into smaller chunks"""
+    """Split large file into smaller chunks, each copied in one executor call"""
     try:
         file_size = os.path.getsize(file_path)
         base_name = os.path.splitext(os.path.basename(file_path))[0]
@@ -241,27 +1379,21 @@ async def split_file(file_path, chunk_size):
 
         split_files = []
 
-        async with aiofiles.open(file_path, 'rb') as source_file:
-            for part_num in range(1, num_parts + 1):
-                part_filename = f"{base_name}.part{part_num:03d}{extension}"
-                part_path = os.path.join(os.path.dirname(file_path), part_filename)
-
-                logger.info(f"Creating part {part_num}/{num_parts}: {part_filename}")
+        loop = asyncio.get_running_loop()
+        for part_num in range(1, num_parts + 1):
+            part_filename = f"{base_name}.part{part_num:03d}{extension}"
+            part_path = os.path.join(os.path.dirname(file_path), part_filename)
 
-                async with aiofiles.open(part_path, 'wb') as part_file:
-                    bytes_to_read = min(chunk_size, file_size - (part_num - 1) * chunk_size)
-                    bytes_read = 0
+            logger.info(f"Creating part {part_num}/{num_parts}: {part_filename}")
 
-                    while bytes_read < bytes_to_read:
-                        chunk = await source_file.read(min(8192, bytes_to_read - bytes_read))
-                        if not chunk:
-                            break
-                        await part_file.write(chunk)
-                        bytes_read += len(chunk)
+            offset = (part_num - 1) * chunk_size
+            await loop.run_in_executor(
+                None, copy_range, file_path, part_path, offset, min(chunk_size, file_size - offset)
+            )
 
-                actual_size = os.path.getsize(part_path)
-                logger.info(f"Part {part_num} created: {actual_size/1024/1024:.1f}MB")
-                split_files.append((part_path, part_filename))
+            actual_size = os.path.getsize(part_path)
+            logger.info(f"Part {part_num} created: {actual_size/1024/1024:.1f}MB")
+            split_files.append((part_path, part_filename))
 
         return split_files
 
@@ -269,267 +1401,2149 @@ async def split_file(file_path, chunk_size):
         logger.error(f"Error splitting file: {e}")
         return []
 
-async def download_thumbnail(url):
-    """Download and prepare thumbnail image"""
+async def run_tool(*args):
+    """Run an external tool and return (returncode, stdout, stderr) as text"""
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    return process.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace')
 
-        # Create temporary file for thumbnail
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            temp_file.write(response.content)
-            temp_path = temp_file.name
+async def probe_keyframes(file_path):
+    """Return (time, byte offset) of every video keyframe, read from the container by ffprobe"""
+    returncode, stdout, stderr = await run_tool(
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,pos,flags', '-of', 'csv=p=0', file_path
+    )
+    if returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {stderr.strip()}")
+
+    keyframes = []
+    for line in stdout.splitlines():
+        fields = line.strip().split(',')
+        if len(fields) < 3 or 'K' not in fields[2]:
+            continue
+        try:
+            keyframes.append((float(fields[0]), int(fields[1])))
+        except ValueError:
+            # Packets without a timestamp or position cannot be cut at
+            continue
 
-        # Resize image if needed (Telegram requirements)
-        with Image.open(temp_path) as img:
-            # Convert to RGB if necessary
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
+    return sorted(keyframes, key=lambda keyframe: keyframe[1])
 
-            # Resize to reasonable dimensions
-            img.thumbnail((320, 320), Image.Resampling.LANCZOS)
-            img.save(temp_path, 'JPEG', quality=85)
+def plan_keyframe_cuts(keyframes, file_size, budget):
+    """Pick cut times so every segment spans at most ``budget`` bytes of the source
 
-        return temp_path
-    except Exception as e:
-        logger.error(f"Failed to download thumbnail from {url}: {e}")
+    Each cut is the last keyframe that still fits, so segments are as large as
+    possible. Returns None when a single GOP is larger than the budget.
+    """
+    if not keyframes:
         return None
 
-def escape_markdown(text):
-    """Escape special characters for Telegram MarkdownV2"""
-    # Characters that need to be escaped in MarkdownV2
-    escape_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
+    cuts = []
+    segment_start = keyframes[0][1]
+    candidate = keyframes[0]
+    # The end of the file closes the last segment
+    for keyframe in keyframes[1:] + [(None, file_size)]:
+        if keyframe[1] - segment_start <= budget:
+            candidate = keyframe
+            continue
+        if candidate[1] == segment_start:
+            return None
+
+        cuts.append(candidate[0])
+        segment_start = candidate[1]
+        if keyframe[1] - segment_start > budget:
+            return None
+        candidate = keyframe
+
+    return cuts
+
+async def split_keyframes(file_path, chunk_size):
+    """Split a video into standalone playable segments at keyframes, without re-encoding
+
+    ffprobe lists the keyframes with their byte offsets, cut points are chosen
+    so each segment's share of the source fits in ``chunk_size``, and ffmpeg's
+    segment muxer stream-copies the parts. Every part starts on a keyframe with
+    reset timestamps, so Telegram can stream each on its own. Files ffmpeg
+    cannot handle fall back to byte-range views.
+    """
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    extension = os.path.splitext(file_path)[1].lower()
+    directory = os.path.dirname(file_path)
+
+    if extension not in KEYFRAME_SPLIT_EXTENSIONS or not (shutil.which('ffmpeg') and shutil.which('ffprobe')):
+        logger.warning(f"Keyframe split unavailable for {extension or 'this file'}, splitting by bytes")
+        return split_file_views(file_path, chunk_size)
+
+    pattern = os.path.join(directory, f"{base_name}.part%03d{extension}")
+    try:
+        keyframes = await probe_keyframes(file_path)
+
+        # Container overhead differs per part, so shrink the budget until every part fits
+        for margin in (0.97, 0.9, 0.8):
+            cuts = plan_keyframe_cuts(keyframes, os.path.getsize(file_path), int(chunk_size * margin))
+            if cuts is None:
+                break
+
+            logger.info(f"Splitting file at {len(cuts)} keyframe(s) into {len(cuts) + 1} playable parts")
+            args = [
+                'ffmpeg', '-v', 'error', '-y', '-i', file_path,
+                '-map', '0:v:0', '-map', '0:a?', '-c', 'copy',
+                '-f', 'segment', '-segment_start_number', '1', '-reset_timestamps', '1'
+            ]
+            if cuts:
+                # Cut slightly before each keyframe so float rounding cannot skip to the next one
+                args += ['-segment_times', ','.join(f"{max(0.0, cut - 0.001):.6f}" for cut in cuts)]
+            if extension != '.mkv':
+                args += ['-segment_format_options', 'movflags=+faststart']
+            returncode, _, stderr = await run_tool(*args, pattern)
+            if returncode != 0:
+                raise RuntimeError(f"ffmpeg failed: {stderr.strip()}")
+
+            split_files = []
+            for part_num in range(1, len(cuts) + 2):
+                part_filename = f"{base_name}.part{part_num:03d}{extension}"
+                split_files.append((os.path.join(directory, part_filename), part_filename))
+
+            sizes = [os.path.getsize(part_path) for part_path, _ in split_files]
+            if max(sizes) <= chunk_size:
+                for part_num, size in enumerate(sizes, 1):
+                    logger.info(f"Part {part_num} created: {size/1024/1024:.1f}MB")
+                return split_files
 
-    for char in escape_chars:
-        text = text.replace(char, f'\\{char}')
+            logger.info(f"A keyframe part came out at {max(sizes)/1024/1024:.1f}MB, cutting smaller")
+            for part_path, _ in split_files:
+                os.unlink(part_path)
 
-    return text
+        logger.warning("No keyframe cuts fit the part size, splitting by bytes")
+    except Exception as e:
+        logger.warning(f"Keyframe split failed ({e}), splitting by bytes")
+
+    # Drop half-written segments before falling back
+    for name in os.listdir(directory or '.'):
+        if name.startswith(f"{base_name}.part") and name.endswith(extension):
+            os.unlink(os.path.join(directory, name))
+
+    return split_file_views(file_path, chunk_size)
+
+_thumbnail_tasks = {}
+_thumbnail_pins = {}
+
+def render_thumbnail(content):
+    """Decode, resize and JPEG-encode a thumbnail from memory (runs off the event loop)"""
+    from PIL import Image
+    with Image.open(io.BytesIO(content)) as img:
+        # Convert to RGB if necessary
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # Resize to reasonable dimensions (Telegram requirements)
+        img.thumbnail((320, 320), Image.Resampling.LANCZOS)
 
-async def upload_video_to_telegram(client, video_path, caption, thumbnail_path=None, part_info=None):
-    """Upload video file to Telegram"""
+        output = io.BytesIO()
+        img.save(output, 'JPEG', quality=85)
+        return output.getvalue()
+
+def store_thumbnail(path, data):
+    """Atomically write a processed thumbnail into the cache and evict the oldest entries over budget"""
+    write_atomic(path, data)
+
+    cached = []
+    for name in os.listdir(config.THUMB_CACHE_DIR):
+        cached_path = os.path.join(config.THUMB_CACHE_DIR, name)
+        try:
+            stat = os.stat(cached_path)
+        except OSError:
+            continue
+        cached.append((stat.st_mtime, stat.st_size, cached_path))
+
+    total = sum(size for _, size, _ in cached)
+    for _, size, cached_path in sorted(cached):
+        if total <= config.THUMB_CACHE_MAX_BYTES:
+            break
+        # Thumbnails of entries still in the pipeline stay on disk
+        if _thumbnail_pins.get(cached_path) or cached_path == path:
+            continue
+        try:
+            os.unlink(cached_path)
+            total -= size
+        except OSError:
+            pass
+
+async def fetch_thumbnail(url, path):
+    """Download a logo and store its processed thumbnail at path"""
+    from aiohttp import ClientTimeout
+    session = get_http_session()
+    async with session.get(convert_google_drive_url(url), timeout=ClientTimeout(total=30)) as response:
+        response.raise_for_status()
+        content = await response.read()
+
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(None, render_thumbnail, content)
+    await loop.run_in_executor(None, store_thumbnail, path, data)
+    return path
+
+async def download_thumbnail(url):
+    """Download and prepare thumbnail image
+
+    Processed thumbnails live in a size-bounded LRU cache keyed by logo URL,
+    so each logo is fetched and encoded once across entries and runs.
+    Concurrent requests for the same logo share one fetch. The returned path
+    is pinned until release_thumbnail() is called.
+    """
+    try:
+        os.makedirs(config.THUMB_CACHE_DIR, exist_ok=True)
+        path = os.path.join(config.THUMB_CACHE_DIR, hashlib.sha1(url.encode()).hexdigest() + '.jpg')
+
+        if os.path.exists(path):
+            # Mark as recently used
+            os.utime(path)
+        else:
+            task = _thumbnail_tasks.get(path)
+            if task is None:
+                task = asyncio.ensure_future(fetch_thumbnail(url, path))
+                _thumbnail_tasks[path] = task
+                task.add_done_callback(lambda _: _thumbnail_tasks.pop(path, None))
+            await asyncio.shield(task)
+
+        _thumbnail_pins[path] = _thumbnail_pins.get(path, 0) + 1
+        return path
+    except Exception as e:
+        logger.error(f"Failed to download thumbnail from {url}: {e}")
+        return None
+
+def release_thumbnail(path):
+    """Unpin a thumbnail returned by download_thumbnail so it can be evicted"""
+    if path in _thumbnail_pins:
+        _thumbnail_pins[path] -= 1
+        if _thumbnail_pins[path] <= 0:
+            del _thumbnail_pins[path]
+
+class RateLimiter:
+    """Token bucket for Telegram sends that halves its rate on FloodWait and recovers additively"""
+
+    def __init__(self, rate=None, burst=None, min_rate=None, max_rate=None):
+        self.rate = rate or config.SEND_RATE
+        self.burst = burst or config.SEND_BURST
+        self.min_rate = min_rate or config.SEND_RATE_MIN
+        self.max_rate = max(max_rate or config.SEND_RATE_MAX, self.rate)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    async def acquire(self):
+        """Wait until a send is allowed"""
+        async with self._lock:
+            while True:
+                now = self._refill()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.min_rate / 2)
+
+    def on_flood_wait(self, seconds):
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+
+_rate_limiters = weakref.WeakKeyDictionary()
+
+def get_rate_limiter(client):
+    """Return the rate limiter shared by all sends through a client"""
+    limiter = _rate_limiters.get(client)
+    if limiter is None:
+        limiter = _rate_limiters[client] = RateLimiter()
+    return limiter
+
+async def send_with_rate_limit(client, send, *args, **kwargs):
+    """Run a Telegram send under the client's rate limiter, waiting out FloodWait and retrying"""
+    from pyrogram.errors import FloodWait
+    limiter = get_rate_limiter(client)
+    for attempt in range(config.FLOOD_WAIT_RETRIES + 1):
+        await limiter.acquire()
+        try:
+            result = await send(*args, **kwargs)
+        except FloodWait as e:
+            if attempt == config.FLOOD_WAIT_RETRIES:
+                raise
+            logger.warning(f"FloodWait: Telegram asked to wait {e.value}s, retrying after it")
+            limiter.on_flood_wait(e.value)
+            get_metrics().flood_wait(e.value)
+            continue
+
+        limiter.on_success()
+        return result
+
+async def invoke_with_flood_wait(client, rpc):
+    """Invoke a raw method, sleeping through FloodWait instead of failing"""
+    from pyrogram.errors import FloodWait
+    for attempt in range(config.FLOOD_WAIT_RETRIES + 1):
+        try:
+            return await client.invoke(rpc)
+        except FloodWait as e:
+            if attempt == config.FLOOD_WAIT_RETRIES:
+                raise
+            logger.warning(f"FloodWait during upload: waiting {e.value}s")
+            get_rate_limiter(client).flood_wait_seconds += e.value
+            get_metrics().flood_wait(e.value)
+            await asyncio.sleep(e.value)
+
+def utf16_len(text):
+    """Length of text in the UTF-16 code units Telegram counts offsets in"""
+    return len(text.encode('utf-16-le')) // 2
+
+def clip_utf16(text, limit):
+    """Cut text to at most limit UTF-16 code units without splitting a surrogate pair"""
+    return text.encode('utf-16-le')[:max(0, limit) * 2].decode('utf-16-le', errors='ignore')
+
+def render_caption(segments):
+    """Render (text, entity_type) segments into caption text and MessageEntity objects
+
+    Formatting is carried by entities, so names never need escaping and a
+    caption cannot be rejected for bad markup. Captions over CAPTION_LIMIT
+    are shortened in their first segment so the lines after it survive.
+    """
+    from pyrogram.types import MessageEntity
+    overflow = sum(utf16_len(text) for text, _ in segments) - CAPTION_LIMIT
+    if overflow > 0:
+        title, entity_type = segments[0]
+        title = clip_utf16(title, utf16_len(title) - overflow - 1) + '…'
+        segments = [(title, entity_type)] + list(segments[1:])
+
+    text = ''
+    entities = []
+    for chunk, entity_type in segments:
+        offset = utf16_len(text)
+        chunk = clip_utf16(chunk, CAPTION_LIMIT - offset)
+        if not chunk:
+            break
+        if entity_type:
+            entities.append(MessageEntity(type=entity_type, offset=offset, length=utf16_len(chunk)))
+        text += chunk
+
+    return text, entities
+
+def build_caption(name, file_name, part_info=None):
+    """Caption for a posted file as (text, entities), with the part number in bold for split files"""
+    from pyrogram.enums import MessageEntityType
+    segments = [(f"🎬 {name}", None), (f"\n\n📁 File: {file_name}", None)]
+    if part_info:
+        segments += [
+            ("\n\n📦 ", None),
+            (f"Part {part_info['current']}/{part_info['total']}", MessageEntityType.BOLD)
+        ]
+    return render_caption(segments)
+
+def caption_attempts(caption):
+    """Return (text, entities, label) attempts for a rendered caption, formatted first"""
+    text, entities = caption
+    attempts = [(text, entities, 'formatted')] if entities else []
+    return attempts + [(text, None, 'plain text')]
+
+class MediaReader:
+    """Async sequential reader over a file path or FileRangeView, for save_stream_file"""
+
+    def __init__(self, media, start=0):
+        if isinstance(media, FileRangeView):
+            self.view = FileRangeView(media.path, media.offset, media.length, media.name)
+        else:
+            self.view = FileRangeView(media, 0, os.path.getsize(media))
+        self.view.seek(start)
+
+    async def read(self, size):
+        return await asyncio.get_running_loop().run_in_executor(None, self.view.read, size)
+
+    def close(self):
+        self.view.close()
+
+async def upload_video_to_telegram(client, video_path, file_name, caption, thumbnail_path=None, job=None,
+                                   checkpoint=None, part_num=1):
+    """Upload video file to Telegram and return the sent message id, or None on failure
+
+    ``caption`` is a rendered (text, entities) pair. The file is transferred
+    once and every caption fallback reuses it; with a ``job`` the post waits
+    for the job's chat turn after the transfer. Failed transfers are retried
+    from the last confirmed file part, which the ledger ``checkpoint`` keeps
+    across runs.
+    """
+    from pyrogram.errors import FilePartMissing
     try:
         # Get file size
-        file_size = os.path.getsize(video_path)
+        file_size = get_media_size(video_path)
         logger.info(f"Uploading video: {file_size / 1024 / 1024:.1f} MB")
 
-        # Add part information to caption if it's a split file
-        if part_info:
-            caption += f"\n\n📦 **Part {part_info['current']}/{part_info['total']}**"
+        transfer = UploadTransfer(client, file_size, checkpoint, part_num)
+        for attempt in range(config.MAX_RETRIES):
+            try:
+                reader = MediaReader(video_path, transfer.begin())
+                try:
+                    input_file = await save_stream_file(client, reader, file_size, file_name, transfer)
+                finally:
+                    reader.close()
+
+                if job:
+                    await wait_send_turn(job)
+
+                message_id = await send_uploaded_video(client, input_file, file_name, caption, thumbnail_path)
+            except FilePartMissing as e:
+                logger.warning(f"Telegram no longer has part {e.value} of the upload, starting over")
+                get_metrics().retry()
+                transfer.reset()
+                continue
+            except Exception as e:
+                logger.warning(f"Upload attempt {attempt + 1} failed at part {transfer.saved}/{transfer.total_parts}: {e}")
+                if attempt < config.MAX_RETRIES - 1:
+                    get_metrics().retry()
+                    await asyncio.sleep(2 ** attempt)
+                continue
+
+            if message_id:
+                transfer.finish()
+                logger.info(f"Successfully uploaded video to Telegram")
+            return message_id
+
+        logger.error(f"Failed to upload video after {config.MAX_RETRIES} attempts")
+        return None
+
+    except Exception as e:
+        logger.error(f"Failed to upload video to Telegram: {e}")
+        return None
 
-        # Try with MarkdownV2 first, then fall back to HTML, then plain text
-        upload_success = False
+class RingBuffer:
+    """Bounded in-memory byte ring between a network producer and an upload consumer"""
+
+    def __init__(self, capacity):
+        self._buffer = bytearray(capacity)
+        self._capacity = capacity
+        self._start = 0
+        self._size = 0
+        self._closed = False
+        self._error = None
+        self._condition = asyncio.Condition()
+
+    async def write(self, data):
+        """Append data, waiting while the ring is full"""
+        view = memoryview(data)
+        while view:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self._size < self._capacity)
+
+                count = min(len(view), self._capacity - self._size)
+                end = (self._start + self._size) % self._capacity
+                first = min(count, self._capacity - end)
+                self._buffer[end:end + first] = view[:first]
+                self._buffer[:count - first] = view[first:count]
+
+                self._size += count
+                view = view[count:]
+                self._condition.notify_all()
+
+    async def read(self, size):
+        """Read exactly size bytes, or fewer if the stream ends first"""
+        data = bytearray()
+        while len(data) < size:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self._size or self._closed or self._error)
+                if self._error:
+                    raise self._error
+                if not self._size:
+                    break
+
+                count = min(size - len(data), self._size)
+                first = min(count, self._capacity - self._start)
+                data += self._buffer[self._start:self._start + first]
+                data += self._buffer[:count - first]
+
+                self._start = (self._start + count) % self._capacity
+                self._size -= count
+                self._condition.notify_all()
+
+        return bytes(data)
+
+    async def close(self, error=None):
+        """Mark the end of the stream, optionally with the error that ended it"""
+        async with self._condition:
+            self._closed = True
+            self._error = error
+            self._condition.notify_all()
+
+async def fill_stream_buffer(session, url, ring, start, end, ranged):
+    """Stream the response body for bytes start..end into a ring buffer"""
+    from aiohttp import ClientError, ClientTimeout
+    headers = {'Range': f'bytes={start}-{end}'} if ranged else {}
+    timeout = ClientTimeout(total=config.DOWNLOAD_TIMEOUT, sock_read=300)  # 5 min read timeout
+
+    try:
+        async with session.get(url, headers=headers, timeout=timeout) as response:
+            if response.status != (206 if ranged else 200):
+                raise ClientError(f"HTTP {response.status} for {url}")
 
-        # Try MarkdownV2 (requires escaping)
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                await ring.write(chunk)
+
+        await ring.close()
+    except Exception as e:
+        await ring.close(e)
+
+class UploadTransfer:
+    """Resumable state of one file transfer to Telegram: session, file id and confirmed part watermark"""
+
+    def __init__(self, client, file_size, checkpoint=None, part_num=1):
+        self.client = client
+        self.file_size = file_size
+        self.checkpoint = checkpoint
+        self.part_num = part_num
+        self.session = getattr(client, 'name', None)
+        self.total_parts = math.ceil(file_size / UPLOAD_PART_SIZE)
+        # Small files carry an md5 of all parts, so they always start over
+        self.resumable = file_size > 10 * 1024 * 1024
+        self.confirmed = set()
+        self.file_id = None
+        self.saved = 0
+        self.synced = 0
+
+        record = checkpoint.transfer(part_num) if checkpoint and self.resumable else None
+        if record and record.get('session') == self.session and record.get('size') == file_size:
+            self.file_id = record['file_id']
+            self.saved = self.synced = record['saved']
+            logger.info(f"Resuming upload of part {part_num} at {self.saved}/{self.total_parts} file parts")
+        else:
+            self.reset()
+
+    def begin(self):
+        """Prepare an attempt and return the byte offset it continues from"""
+        if not self.resumable:
+            self.reset()
+        self.confirmed.clear()
+        return self.saved * UPLOAD_PART_SIZE
+
+    def reset(self):
+        """Start over under a new file id"""
+        self.file_id = self.client.rnd_id()
+        self.saved = 0
+        self.confirmed.clear()
+        self.sync()
+
+    def confirm(self, file_part):
+        """Record a saved file part and advance the contiguous watermark"""
+        self.confirmed.add(file_part)
+        while self.saved in self.confirmed:
+            self.confirmed.remove(self.saved)
+            self.saved += 1
+
+        if (self.saved - self.synced) * UPLOAD_PART_SIZE >= config.LEDGER_SYNC_BYTES:
+            self.sync()
+
+    def sync(self):
+        """Journal the watermark in the ledger"""
+        self.synced = self.saved
+        if self.checkpoint and self.resumable:
+            self.checkpoint.record_transfer(self.part_num, {
+                'session': self.session,
+                'file_id': self.file_id,
+                'size': self.file_size,
+                'saved': self.saved
+            })
+
+    def finish(self):
+        """Forget the transfer once its message is posted"""
+        if self.checkpoint and self.resumable:
+            self.checkpoint.record_transfer(self.part_num, None)
+
+async def save_stream_file(client, source, file_size, file_name, transfer=None):
+    """Upload file_size bytes read from a RingBuffer or MediaReader as Telegram file parts
+
+    With an ``UploadTransfer`` the parts below its confirmed watermark are
+    skipped, so ``source`` has to start at the offset its ``begin()`` returned.
+    """
+    from aiohttp import ClientError
+    from pyrogram import raw
+    if transfer is None:
+        transfer = UploadTransfer(client, file_size)
+        transfer.begin()
+
+    total_parts = transfer.total_parts
+    is_big = transfer.resumable
+    file_id = transfer.file_id
+    md5_sum = None if is_big else hashlib.md5()
+
+    in_flight = asyncio.Semaphore(config.UPLOAD_PART_WORKERS)
+    tasks = []
+
+    async def save_part(rpc):
         try:
-            escaped_caption = escape_markdown(caption)
-            message = await client.send_video(
-                chat_id=GROUP_ID,
-                video=video_path,
-                thumb=thumbnail_path,
-                caption=escaped_caption,
-                parse_mode=ParseMode.MARKDOWN,
-                supports_streaming=True,
-                progress=upload_progress
-            )
-            upload_success = True
-            logger.info("Successfully uploaded with MarkdownV2 formatting")
-        except Exception as md_error:
-            logger.warning(f"MarkdownV2 upload failed: {md_error}")
+            if not await invoke_with_flood_wait(client, rpc):
+                raise RuntimeError(f"Telegram rejected file part {rpc.file_part}")
+            transfer.confirm(rpc.file_part)
+            get_metrics().add('upload', nbytes=len(rpc.bytes))
+        finally:
+            in_flight.release()
 
-            # Try HTML formatting
-            try:
-                html_caption = caption.replace('**', '<b>').replace('**', '</b>')
-                html_caption = html_caption.replace('`', '<code>').replace('`', '</code>')
+    try:
+        for file_part in range(transfer.saved, total_parts):
+            expected = min(UPLOAD_PART_SIZE, file_size - file_part * UPLOAD_PART_SIZE)
+            chunk = await source.read(expected)
+            if len(chunk) < expected:
+                raise ClientError(f"Stream ended early at part {file_part + 1}/{total_parts}")
+
+            if is_big:
+                rpc = raw.functions.upload.SaveBigFilePart(
+                    file_id=file_id,
+                    file_part=file_part,
+                    file_total_parts=total_parts,
+                    bytes=chunk
+                )
+            else:
+                md5_sum.update(chunk)
+                rpc = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=file_part, bytes=chunk)
 
-                message = await client.send_video(
-                    chat_id=GROUP_ID,
-                    video=video_path,
-                    thumb=thumbnail_path,
-                    caption=html_caption,
-                    parse_mode=ParseMode.HTML,
-                    supports_streaming=True,
-                    progress=upload_progress
+            await in_flight.acquire()
+            tasks.append(asyncio.create_task(save_part(rpc)))
+
+            # Surface failed parts without waiting for the whole file
+            for task in tasks:
+                if task.done() and task.exception():
+                    raise task.exception()
+            tasks = [task for task in tasks if not task.done()]
+
+            await upload_progress(min((file_part + 1) * UPLOAD_PART_SIZE, file_size), file_size, file_part * UPLOAD_PART_SIZE)
+
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        transfer.sync()
+        raise
+
+    if is_big:
+        return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+    return raw.types.InputFile(id=file_id, parts=total_parts, name=file_name, md5_checksum=md5_sum.hexdigest())
+
+def sent_message_id(updates):
+    """Extract the id of the message created by a send request"""
+    from pyrogram import raw
+    if isinstance(updates, raw.types.UpdateShortSentMessage):
+        return updates.id
+    for update in getattr(updates, 'updates', []):
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return update.message.id
+        if isinstance(update, raw.types.UpdateMessageID):
+            return update.id
+    return None
+
+async def uploaded_video_media(client, input_file, file_name, thumbnail_path=None):
+    """Streamable video media for an already uploaded file"""
+    from pyrogram import raw
+    thumb = await client.save_file(thumbnail_path) if thumbnail_path else None
+    return raw.types.InputMediaUploadedDocument(
+        mime_type=client.guess_mime_type(file_name) or "video/mp4",
+        file=input_file,
+        thumb=thumb,
+        attributes=[
+            raw.types.DocumentAttributeVideo(supports_streaming=True, duration=0, w=0, h=0),
+            raw.types.DocumentAttributeFilename(file_name=file_name)
+        ]
+    )
+
+def sent_message_ids(updates):
+    """Map the random ids of a multi-message send to the ids of the created messages"""
+    from pyrogram import raw
+    return {
+        update.random_id: update.id
+        for update in getattr(updates, 'updates', [])
+        if isinstance(update, raw.types.UpdateMessageID)
+    }
+
+async def send_uploaded_video(client, input_file, file_name, caption, thumbnail_path=None):
+    """Post an already uploaded file as a video with a rendered caption and return its message id"""
+    from pyrogram import raw, utils
+    from pyrogram.enums import ParseMode
+    from pyrogram.errors import FilePartMissing
+    media = await uploaded_video_media(client, input_file, file_name, thumbnail_path)
+    peer = await client.resolve_peer(GROUP_ID)
+
+    # The uploaded file is reused, so a caption fallback costs no extra transfer
+    for text, entities, label in caption_attempts(caption):
+        try:
+            updates = await send_with_rate_limit(
+                client,
+                client.invoke,
+                raw.functions.messages.SendMedia(
+                    peer=peer,
+                    media=media,
+                    random_id=client.rnd_id(),
+                    **await utils.parse_text_entities(client, text, ParseMode.DISABLED, entities)
                 )
-                upload_success = True
-                logger.info("Successfully uploaded with HTML formatting")
-            except Exception as html_error:
-                logger.warning(f"HTML upload failed: {html_error}")
+            )
+            logger.info(f"Successfully uploaded with {label} formatting")
+            message_id = sent_message_id(updates)
+            if message_id is None:
+                # Without its id the message can be neither resumed nor copied later
+                logger.error("Telegram did not report the id of the posted message")
+            return message_id
+        except FilePartMissing:
+            # The upload itself is gone, another caption will not help
+            raise
+        except Exception as send_error:
+            logger.warning(f"{label} upload failed: {send_error}")
+
+    logger.error("Failed to upload with any formatting method")
+    return None
+
+async def stream_upload_job(client, job, checkpoint=None):
+    """Upload an entry straight from the HTTP response without a temp file
+
+    Telegram parts are cut at MAX_FILE_SIZE boundaries as the data arrives, so
+    only STREAM_BUFFER_SIZE bytes are held in memory. When the server supports
+    Range, every part is its own request and can be retried on its own.
+    """
+    from pyrogram.errors import FilePartMissing
+    url = await resolve_url(job['entry']['link'])
+    file_size = job['stream']['size']
+    ranged = job['stream']['accept_ranges']
+    base_name, extension = os.path.splitext(job['filename'])
+
+    num_parts = math.ceil(file_size / config.MAX_FILE_SIZE)
+    logger.info(f"Streaming {file_size / 1024 / 1024:.1f} MB in {num_parts} part(s): {job['filename']}")
+
+    success_count = 0
+    producer = None
+    ring = None
+    session = get_http_session()
+    try:
+        for i in range(1, num_parts + 1):
+            offset = (i - 1) * config.MAX_FILE_SIZE
+            length = min(config.MAX_FILE_SIZE, file_size - offset)
+            part_filename = f"{base_name}.part{i:03d}{extension}" if num_parts > 1 else job['filename']
+            already_uploaded = posted_part(job, checkpoint, i)
+
+            # A ranged part is skipped outright, a single stream has to be read past it
+            if already_uploaded and ranged:
+                logger.info(f"Part {i}/{num_parts} already uploaded, skipping")
+                success_count += 1
+                continue
+
+            if producer is None and not ranged:
+                ring = RingBuffer(max(config.STREAM_BUFFER_SIZE, UPLOAD_PART_SIZE))
+                producer = asyncio.create_task(fill_stream_buffer(session, url, ring, 0, file_size - 1, ranged))
+
+            if already_uploaded:
+                logger.info(f"Part {i}/{num_parts} already uploaded, skipping")
+                for _ in range(0, length, UPLOAD_PART_SIZE):
+                    await ring.read(UPLOAD_PART_SIZE)
+                success_count += 1
+                continue
+
+            transfer = UploadTransfer(client, length, checkpoint, i)
+            input_file = None
+            for attempt in range(config.MAX_RETRIES if ranged else 1):
+                skip = transfer.begin()
+                if ranged and producer is None and skip < length:
+                    # A ranged request starts right after the last confirmed Telegram part
+                    ring = RingBuffer(max(config.STREAM_BUFFER_SIZE, UPLOAD_PART_SIZE))
+                    producer = asyncio.create_task(
+                        fill_stream_buffer(session, url, ring, offset + skip, offset + length - 1, ranged)
+                    )
+                elif not ranged:
+                    for _ in range(0, skip, UPLOAD_PART_SIZE):
+                        await ring.read(UPLOAD_PART_SIZE)
 
-                # Fall back to plain text
                 try:
-                    plain_caption = caption.replace('**', '').replace('`', '')
-                    message = await client.send_video(
-                        chat_id=GROUP_ID,
-                        video=video_path,
-                        thumb=thumbnail_path,
-                        caption=plain_caption,
-                        supports_streaming=True,
-                        progress=upload_progress
-                    )
-                    upload_success = True
-                    logger.info("Successfully uploaded with plain text formatting")
-                except Exception as plain_error:
-                    logger.error(f"All formatting attempts failed: {plain_error}")
+                    input_file = await save_stream_file(client, ring, length, part_filename, transfer)
+                    break
+                except Exception as e:
+                    logger.warning(f"Streaming part {i}/{num_parts} attempt {attempt + 1} failed: {e}")
+                    if producer:
+                        producer.cancel()
+                        producer = None
+                    if attempt < config.MAX_RETRIES - 1:
+                        if ranged:
+                            get_metrics().retry()
+                        await asyncio.sleep(2 ** attempt)
+
+            if ranged and producer:
+                await producer
+                producer = None
+
+            if input_file is None:
+                logger.error(f"❌ Failed to stream part {i}/{num_parts}")
+                break
+
+            part_info = {'current': i, 'total': num_parts} if num_parts > 1 else None
+            caption = build_caption(job['name'], part_filename, part_info)
+
+            await wait_send_turn(job)
+            try:
+                message_id = await send_uploaded_video(
+                    client, input_file, part_filename, caption, job['thumbnail_path']
+                )
+            except FilePartMissing as e:
+                logger.warning(f"Telegram no longer has part {e.value} of the upload, it restarts next time")
+                transfer.reset()
+                message_id = None
+
+            if message_id:
+                success_count += 1
+                logger.info(f"✅ Uploaded part {i}/{num_parts}")
+                transfer.finish()
+                record_posted_part(job, checkpoint, i, message_id)
+            else:
+                logger.error(f"❌ Failed to upload part {i}/{num_parts}")
 
-        if upload_success:
-            logger.info(f"Successfully uploaded video to Telegram")
-            return True
-        else:
-            logger.error("Failed to upload with any formatting method")
-            return False
+    finally:
+        if producer:
+            producer.cancel()
 
-    except Exception as e:
-        logger.error(f"Failed to upload video to Telegram: {e}")
-        return False
+    return success_count == num_parts
 
-async def upload_progress(current, total):
-    """Progress callback for upload"""
+async def upload_progress(current, total, previous=0):
+    """Progress callback for upload, logging whenever ``previous`` to ``current`` crosses a 5% step"""
     if total > 0:
         progress = (current / total) * 100
         current_mb = current // (1024 * 1024)
         total_mb = total // (1024 * 1024)
-        if progress % 5 == 0:  # Log every 5%
+        if current * 20 // total > previous * 20 // total:  # Log every 5%
             logger.info(f"Upload progress: {progress:.0f}% ({current_mb}/{total_mb} MB)")
 
-async def process_media_entry(client, entry):
-    """Process and upload a single media entry"""
-    try:
-        name = entry['name']
-        link = entry['link']
-        logo_url = entry['tvg-logo']
-        entry_id = entry['id']
+async def prepare_media_entry(entry, checkpoint=None, dedup=None, file_info=None):
+    """Download thumbnail and video for an entry and split it if needed
+
+    Entries already posted under the same URL or content hash are marked as
+    duplicates in ``dedup`` and skip the rest of the preparation. A
+    ``file_info`` probed during admission is reused instead of a new HEAD.
+    """
+    name = entry['name']
+    link = entry['link']
+    logo_url = entry['tvg-logo']
+    entry_id = entry['id']
+    current_entry.set(entry_id)
+    metrics = get_metrics()
+    # The entry's latency is measured from here
+    metrics.entry(entry_id)
+
+    logger.info(f"Preparing ID {entry_id}: {name}")
+
+    # Generate clean filename
+    filename = get_clean_filename(name, link)
+
+    job = {
+        'entry': entry,
+        'name': name,
+        'filename': filename,
+        'thumbnail_path': None,
+        'video_path': None,
+        'parts': [],
+        'stream': None,
+        'content_hash': None,
+        'duplicate': None,
+        'posted': {}
+    }
+
+    # Known URLs are forwarded without downloading anything
+    if dedup:
+        job['duplicate'] = dedup.lookup(url=link)
+        if job['duplicate']:
+            logger.info(f"ID {entry_id} was already posted from the same URL")
+            return job
+
+    # Download thumbnail
+    if logo_url:
+        with metrics.stage('thumbnail'):
+            job['thumbnail_path'] = await download_thumbnail(logo_url)
+
+    # Stream straight to Telegram when the size is known up front
+    if config.STREAM_MODE:
+        file_info = file_info or await probe_file(link)
+        if 0 < file_info['size'] <= config.TELEGRAM_LIMIT * 10:
+            job['stream'] = file_info
+            return job
+        logger.info(f"Size unknown for ID {entry_id}, falling back to a full download")
+
+    # Download video file
+    digest = {} if dedup else None
+    with metrics.stage('download') as download_stage:
+        job['video_path'] = await download_file(link, filename, checkpoint, digest, file_info)
+        if job['video_path']:
+            download_stage['bytes'] = os.path.getsize(job['video_path'])
+    if not job['video_path']:
+        logger.error(f"Failed to download video for ID {entry_id}")
+        cleanup_media_job(job)
+        return None
 
-        logger.info(f"Processing ID {entry_id}: {name}")
+    if digest:
+        job['content_hash'] = digest['sha256']
+        job['duplicate'] = dedup.lookup(content_hash=job['content_hash'])
+        if job['duplicate']:
+            logger.info(f"ID {entry_id} has the same content as an earlier upload")
+            return job
+
+    # Check if file needs splitting
+    file_size = os.path.getsize(job['video_path'])
+    if file_size > config.MAX_FILE_SIZE:
+        logger.info(f"File size ({file_size/1024/1024:.1f} MB) exceeds limit, splitting...")
+
+        with metrics.stage('split'):
+            if config.SPLIT_MODE == 'keyframe':
+                job['parts'] = await split_keyframes(job['video_path'], config.MAX_FILE_SIZE)
+            elif config.SPLIT_MODE == 'copy':
+                job['parts'] = await split_file(job['video_path'], config.MAX_FILE_SIZE)
+            else:
+                job['parts'] = split_file_views(job['video_path'], config.MAX_FILE_SIZE)
+        if not job['parts']:
+            logger.error(f"Failed to split file for ID {entry_id}")
+            cleanup_media_job(job)
+            return None
 
-        # Generate clean filename
-        filename = get_clean_filename(name, link)
+    return job
+
+def posted_part(job, checkpoint, part_num):
+    """Message id of a part posted by an earlier attempt or run, if any"""
+    message_id = job['posted'].get(part_num)
+    if not message_id and checkpoint:
+        message_id = checkpoint.uploaded_part(part_num)
+        if message_id:
+            job['posted'][part_num] = message_id
+    return message_id
+
+def record_posted_part(job, checkpoint, part_num, message_id):
+    """Remember the message id of a posted part on the job and in the ledger"""
+    job['posted'][part_num] = message_id
+    if checkpoint:
+        checkpoint.record_part(part_num, message_id)
+
+async def copy_duplicate_job(client, job, checkpoint=None):
+    """Post a duplicate entry by copying the messages of its earlier upload"""
+    from pyrogram.enums import ParseMode
+    record = job['duplicate']
+    message_ids = record['message_ids']
+
+    success_count = 0
+    for i, source_id in enumerate(message_ids, 1):
+        if posted_part(job, checkpoint, i):
+            success_count += 1
+            continue
+
+        part_info = {'current': i, 'total': len(message_ids)} if len(message_ids) > 1 else None
+        caption = build_caption(job['name'], job['filename'], part_info)
+
+        await wait_send_turn(job)
+        for text, entities, label in caption_attempts(caption):
+            try:
+                message = await send_with_rate_limit(
+                    client,
+                    client.copy_message,
+                    chat_id=GROUP_ID,
+                    from_chat_id=record['chat_id'],
+                    message_id=source_id,
+                    caption=text,
+                    parse_mode=ParseMode.DISABLED,
+                    caption_entities=entities
+                )
+                success_count += 1
+                record_posted_part(job, checkpoint, i, message.id)
+                break
+            except Exception as copy_error:
+                logger.warning(f"{label} copy of message {source_id} failed: {copy_error}")
+
+    logger.info(f"Copied {success_count}/{len(message_ids)} message(s) of an earlier upload")
+    return success_count == len(message_ids)
+
+async def upload_media_job(client, job, checkpoint=None, dedup=None):
+    """Upload a prepared entry (single file or split parts) to Telegram
+
+    Posted message ids are recorded per part in the ledger ``checkpoint``, and
+    parts it already lists are skipped. Successful uploads are added to the
+    ``dedup`` index, and entries that turn out to be duplicates are copied.
+    """
+    current_entry.set(job['entry']['id'])
+    if dedup and not job['duplicate']:
+        # An earlier entry may have posted the same media while this one downloaded
+        job['duplicate'] = dedup.lookup(url=job['entry']['link'], content_hash=job['content_hash'])
+
+    with get_metrics().stage('upload'):
+        if job['duplicate']:
+            return await copy_duplicate_job(client, job, checkpoint)
+
+        success = await upload_new_media(client, job, checkpoint)
+
+    if success and dedup:
+        dedup.record(
+            url=job['entry']['link'],
+            content_hash=job['content_hash'],
+            chat_id=GROUP_ID,
+            message_ids=[job['posted'][part_num] for part_num in sorted(job['posted'])]
+        )
 
-        # Download thumbnail
-        thumbnail_path = None
-        if logo_url:
-            thumbnail_path = await download_thumbnail(logo_url)
+    return success
 
-        # Download video file
-        video_path = await download_file(link, filename)
-        if not video_path:
-            logger.error(f"Failed to download video for ID {entry_id}")
-            return False
+async def transfer_file(client, media, file_name, transfer):
+    """Upload a file path or FileRangeView to Telegram without posting it, retrying from the last confirmed part"""
+    for attempt in range(config.MAX_RETRIES):
+        try:
+            reader = MediaReader(media, transfer.begin())
+            try:
+                return await save_stream_file(client, reader, transfer.file_size, file_name, transfer)
+            finally:
+                reader.close()
+        except Exception as e:
+            logger.warning(f"Upload attempt {attempt + 1} failed at part {transfer.saved}/{transfer.total_parts}: {e}")
+            if attempt < config.MAX_RETRIES - 1:
+                get_metrics().retry()
+                await asyncio.sleep(2 ** attempt)
+
+    logger.error(f"Failed to upload {file_name} after {config.MAX_RETRIES} attempts")
+    return None
+
+def is_group_job(job, checkpoint=None):
+    """Whether a prepared job is a single small new file that can go into an album"""
+    return bool(
+        config.MEDIA_GROUP_MAX_SIZE and job and job['video_path'] and not job['parts'] and not job['duplicate']
+        and not posted_part(job, checkpoint, 1)
+        and os.path.getsize(job['video_path']) <= config.MEDIA_GROUP_MAX_SIZE
+    )
+
+async def upload_media_group(client, jobs, checkpoints, dedup=None):
+    """Post several small prepared jobs as one album
+
+    Returns whether each job was posted with a known message id, or None if
+    the album could not be sent.
+
+    Every file is transferred once and turned into a document with
+    UploadMedia, then a single SendMultiMedia posts the album, so a batch of
+    up to MEDIA_GROUP_LIMIT entries costs one rate-limited send.
+    """
+    from pyrogram import raw, utils
+    from pyrogram.enums import ParseMode
+    peer = await client.resolve_peer(GROUP_ID)
+    documents = []
+    transfers = []
+    for job, checkpoint in zip(jobs, checkpoints):
+        current_entry.set(job['entry']['id'])
+        transfer = UploadTransfer(client, os.path.getsize(job['video_path']), checkpoint)
+        input_file = await transfer_file(client, job['video_path'], job['filename'], transfer)
+        if input_file is None:
+            return None
 
         try:
-            file_size = os.path.getsize(video_path)
+            media = await uploaded_video_media(client, input_file, job['filename'], job['thumbnail_path'])
+            uploaded = await invoke_with_flood_wait(client, raw.functions.messages.UploadMedia(peer=peer, media=media))
+        except Exception as e:
+            logger.warning(f"Could not turn {job['filename']} into an album document: {e}")
+            return None
+        documents.append(raw.types.InputDocument(
+            id=uploaded.document.id,
+            access_hash=uploaded.document.access_hash,
+            file_reference=uploaded.document.file_reference
+        ))
+        transfers.append(transfer)
+
+    captions = [build_caption(job['name'], job['filename']) for job in jobs]
+    formats = [True, False] if any(entities for _, entities in captions) else [False]
+
+    await wait_send_turn(jobs[0])
+    for formatted in formats:
+        multi_media = []
+        for document, (text, entities) in zip(documents, captions):
+            multi_media.append(raw.types.InputSingleMedia(
+                media=raw.types.InputMediaDocument(id=document),
+                random_id=client.rnd_id(),
+                **await utils.parse_text_entities(client, text, ParseMode.DISABLED, entities if formatted else None)
+            ))
 
-            # Check if file needs splitting
-            if file_size > MAX_FILE_SIZE:
-                logger.info(f"File size ({file_size/1024/1024:.1f} MB) exceeds limit, splitting...")
+        try:
+            updates = await send_with_rate_limit(
+                client,
+                client.invoke,
+                raw.functions.messages.SendMultiMedia(peer=peer, multi_media=multi_media)
+            )
+        except Exception as send_error:
+            logger.warning(f"{'formatted' if formatted else 'plain text'} album of {len(jobs)} failed: {send_error}")
+            continue
+
+        message_ids = sent_message_ids(updates)
+        results = []
+        for job, checkpoint, transfer, single in zip(jobs, checkpoints, transfers, multi_media):
+            transfer.finish()
+            message_id = message_ids.get(single.random_id)
+            if message_id is None:
+                logger.error(f"Telegram did not report the message id of ID {job['entry']['id']} in the album")
+                results.append(False)
+                continue
+            record_posted_part(job, checkpoint, 1, message_id)
+            if dedup:
+                dedup.record(url=job['entry']['link'], content_hash=job['content_hash'],
+                             chat_id=GROUP_ID, message_ids=[message_id])
+            results.append(True)
+        logger.info(f"✅ Posted an album of {len(jobs)} videos")
+        return results
+
+    return None
+
+async def upload_new_media(client, job, checkpoint=None):
+    """Upload the media of a prepared job that has not been posted before"""
+    name = job['name']
+    thumbnail_path = job['thumbnail_path']
+    split_files = job['parts']
+
+    if job['stream']:
+        return await stream_upload_job(client, job, checkpoint)
+
+    if not split_files:
+        if posted_part(job, checkpoint, 1):
+            logger.info(f"ID {job['entry']['id']} already uploaded, skipping")
+            return True
 
-                # Split the file
-                split_files = await split_file(video_path, MAX_FILE_SIZE)
+        # File is small enough, upload directly
+        caption = build_caption(name, job['filename'])
+        message_id = await upload_video_to_telegram(
+            client, job['video_path'], job['filename'], caption, thumbnail_path, job, checkpoint
+        )
+        if message_id:
+            record_posted_part(job, checkpoint, 1, message_id)
+        return bool(message_id)
 
-                if not split_files:
-                    logger.error(f"Failed to split file for ID {entry_id}")
-                    return False
+    # Upload each part
+    success_count = 0
+    for i, (part_path, part_filename) in enumerate(split_files, 1):
+        try:
+            if posted_part(job, checkpoint, i):
+                logger.info(f"Part {i}/{len(split_files)} already uploaded, skipping")
+                success_count += 1
+                release_part(part_path)
+                continue
 
-                # Upload each part
-                success_count = 0
-                for i, (part_path, part_filename) in enumerate(split_files, 1):
-                    try:
-                        part_caption = f"🎬 {name}\n\n📁 File: {part_filename}"
-                        part_info = {'current': i, 'total': len(split_files)}
+            part_info = {'current': i, 'total': len(split_files)}
+            part_caption = build_caption(name, part_filename, part_info)
 
-                        success = await upload_video_to_telegram(
-                            client, part_path, part_caption, thumbnail_path, part_info
-                        )
+            message_id = await upload_video_to_telegram(
+                client, part_path, part_filename, part_caption, thumbnail_path, job, checkpoint, i
+            )
 
-                        if success:
-                            success_count += 1
-                            logger.info(f"✅ Uploaded part {i}/{len(split_files)}")
-                        else:
-                            logger.error(f"❌ Failed to upload part {i}/{len(split_files)}")
+            if message_id:
+                success_count += 1
+                logger.info(f"✅ Uploaded part {i}/{len(split_files)}")
+                record_posted_part(job, checkpoint, i, message_id)
+            else:
+                logger.error(f"❌ Failed to upload part {i}/{len(split_files)}")
 
-                        # Cleanup part file
-                        try:
-                            os.unlink(part_path)
-                        except:
-                            pass
+            # Cleanup part file
+            release_part(part_path)
 
-                        # Delay between parts
-                        if i < len(split_files):
-                            await asyncio.sleep(3)
+        except Exception as part_error:
+            logger.error(f"Error uploading part {i}: {part_error}")
 
-                    except Exception as part_error:
-                        logger.error(f"Error uploading part {i}: {part_error}")
+    return success_count == len(split_files)
 
-                return success_count == len(split_files)
+def release_part(part):
+    """Close a part view or delete a part file"""
+    try:
+        if isinstance(part, FileRangeView):
+            part.close()
+        elif os.path.exists(part):
+            os.unlink(part)
+    except Exception as cleanup_error:
+        logger.warning(f"Cleanup error: {cleanup_error}")
+
+def cleanup_media_job(job):
+    """Remove the downloaded video and leftover parts of a job and release its thumbnail"""
+    with get_metrics().stage('cleanup', job['entry']['id']):
+        for part_path, _ in job['parts']:
+            release_part(part_path)
+
+        if job['thumbnail_path']:
+            release_thumbnail(job['thumbnail_path'])
 
-            else:
-                # File is small enough, upload directly
-                caption = f"🎬 {name}\n\n📁 File: {filename}"
-                return await upload_video_to_telegram(client, video_path, caption, thumbnail_path)
+        try:
+            if job['video_path'] and os.path.exists(job['video_path']):
+                os.unlink(job['video_path'])
+        except Exception as cleanup_error:
+            logger.warning(f"Cleanup error: {cleanup_error}")
+
+async def process_media_entry(client, entry):
+    """Process and upload a single media entry"""
+    try:
+        job = await prepare_media_entry(entry)
+        if not job:
+            return False
 
+        try:
+            success = await upload_media_job(client, job)
+            get_metrics().finish_entry(entry['id'], success)
+            return success
         finally:
-            # Cleanup files
-            try:
-                if video_path and os.path.exists(video_path):
-                    os.unlink(video_path)
-                if thumbnail_path and os.path.exists(thumbnail_path):
-                    os.unlink(thumbnail_path)
-            except Exception as cleanup_error:
-                logger.warning(f"Cleanup error: {cleanup_error}")
+            cleanup_media_job(job)
 
     except Exception as e:
         logger.error(f"Error processing entry {entry.get('id', 'unknown')}: {e}")
         return False
 
-async def main():
-    """Main function to process and upload media"""
-    try:
-        # Download or load JSON data
-        media_data = await download_json_data()
+def get_temp_dir():
+    """Directory for downloads and split parts, a subdirectory per shard"""
+    directory = config.TEMP_DIR or tempfile.gettempdir()
+    if config.SHARD_COUNT > 1:
+        directory = os.path.join(directory, f"shard_{config.SHARD_INDEX}")
+        os.makedirs(directory, exist_ok=True)
+    return directory
+
+def temp_space_needed(file_info):
+    """Bytes of temp storage an entry will occupy at its peak, judged from its HEAD probe
+
+    Streamed entries need none, byte-range views none beyond the download,
+    and copied or keyframe parts exist next to the full file. Entries of
+    unknown size are assumed to be as large as one part.
+    """
+    size = file_info['size']
+    if config.STREAM_MODE and 0 < size <= config.TELEGRAM_LIMIT * 10:
+        return 0
+    if size <= 0:
+        return config.MAX_FILE_SIZE
+    if size > config.MAX_FILE_SIZE and config.SPLIT_MODE in ('copy', 'keyframe'):
+        return 2 * size
+    return size
+
+class TempStorage:
+    """Byte budget for downloads and split parts in the temp directory"""
+
+    def __init__(self, directory=None, budget=None):
+        self.directory = directory or get_temp_dir()
+        os.makedirs(self.directory, exist_ok=True)
+        self.budget = budget or config.TEMP_BUDGET
+        self.capacity = self.measure()
+        self.reserved = 0
+        self._condition = asyncio.Condition()
+
+    def measure(self):
+        """Budget usable on the temp disk right now"""
+        free = max(0, shutil.disk_usage(self.directory).free - config.TEMP_FREE_MARGIN)
+        return min(self.budget, free) if self.budget else free
+
+    def fits(self, nbytes):
+        """Whether nbytes can ever be reserved"""
+        return nbytes <= self.capacity
+
+    async def reserve(self, nbytes):
+        """Wait until nbytes fit next to the current reservations and claim them"""
+        async with self._condition:
+            if self.reserved + nbytes > self.capacity:
+                logger.info(
+                    f"Waiting for {nbytes / 1024 / 1024:.1f} MB of temp space "
+                    f"({self.reserved / 1024 / 1024:.1f} of {self.capacity / 1024 / 1024:.1f} MB reserved)"
+                )
+            await self._condition.wait_for(lambda: self.reserved + nbytes <= self.capacity)
+            self.reserved += nbytes
+
+    async def release(self, nbytes):
+        """Return a reservation once its files are gone"""
+        async with self._condition:
+            self.reserved -= nbytes
+            self._condition.notify_all()
+
+    def remove_orphans(self, keep=()):
+        """Delete temp files and parts left behind by crashed runs, except the resumable paths in keep
+
+        Call this at startup, before anything is reserved.
+        """
+        keep = {os.path.abspath(path) for path in keep if path}
+        removed = 0
+        freed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.abspath(os.path.join(self.directory, name))
+            if not name.startswith(TEMP_PREFIX) or path in keep or not os.path.isfile(path):
+                continue
+            try:
+                size = os.path.getsize(path)
+                os.unlink(path)
+                removed += 1
+                freed += size
+            except OSError as e:
+                logger.warning(f"Could not remove orphaned temp file {path}: {e}")
+
+        if removed:
+            logger.info(f"Removed {removed} orphaned temp file(s), {freed / 1024 / 1024:.1f} MB")
+            self.capacity = self.measure()
+
+class DedupIndex:
+    """Chat and message ids of posted media, keyed by source URL and content hash"""
+
+    def __init__(self, path):
+        self.path = path
+        self.urls = {}
+        self.hashes = {}
+        self.dirty = False
+        self._saving = None
+
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+                self.urls = data.get('urls', {})
+                self.hashes = data.get('hashes', {})
+                logger.info(f"Loaded dedup index with {len(self.urls)} URLs and {len(self.hashes)} hashes")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable dedup index {path}: {e}")
+
+    def lookup(self, url=None, content_hash=None):
+        """Return the record of an earlier upload of this URL or content, if any"""
+        if url and url in self.urls:
+            return self.urls[url]
+        if content_hash and content_hash in self.hashes:
+            return self.hashes[content_hash]
+        return None
 
-        # Filter entries starting from specified ID
-        entries_to_upload = [entry for entry in media_data if entry['id'] >= START_FROM_ID]
-        logger.info(f"Will upload {len(entries_to_upload)} entries starting from ID {START_FROM_ID}")
+    def record(self, url, content_hash, chat_id, message_ids):
+        """Remember an upload and persist the index
 
-        if not entries_to_upload:
-            logger.info("No entries to upload")
+        Records without real message ids are skipped, since a duplicate
+        could not be copied from them.
+        """
+        if not message_ids or not all(type(message_id) is int for message_id in message_ids):
             return
 
-        # Initialize Pyrogram client
-        client = Client(
-            "media_uploader",
-            api_id=API_ID,
-            api_hash=API_HASH,
-            session_string=SESSION_STRING
-        )
+        entry = {'chat_id': chat_id, 'message_ids': message_ids}
+        self.urls[url] = entry
+        if content_hash:
+            self.hashes[content_hash] = entry
+        self.save()
+
+    def _write(self, urls, hashes):
+        write_atomic(self.path, json.dumps({'urls': urls, 'hashes': hashes}, ensure_ascii=False))
+
+    def save(self):
+        """Persist the index, in the executor when called on the event loop
 
-        async with client:
-            logger.info("Connected to Telegram")
+        Records arriving while a write runs are folded into one more write.
+        """
+        self.dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.dirty = False
+            self._write(self.urls, self.hashes)
+            return
+        if self._saving is None or self._saving.done():
+            self._saving = loop.create_task(self._save_pending())
 
-            successful_uploads = 0
-            failed_uploads = 0
+    async def _save_pending(self):
+        loop = asyncio.get_running_loop()
+        while self.dirty:
+            self.dirty = False
+            try:
+                # Snapshots, since records keep arriving while the executor serializes
+                await loop.run_in_executor(None, self._write, dict(self.urls), dict(self.hashes))
+            except OSError as e:
+                logger.warning(f"Could not save dedup index {self.path}: {e}")
+
+    async def flush(self):
+        """Wait until every record is on disk"""
+        if self._saving:
+            await self._saving
+
+def other_shard_paths(path):
+    """Existing state files of the same base path under every other shard layout"""
+    root, extension = os.path.splitext(path)
+    root = re.sub(r'\.shard\d+$', '', root)
+    pattern = re.compile(re.escape(root) + r'(\.shard\d+)?' + re.escape(extension))
+    candidates = glob.glob(f"{glob.escape(root)}*{glob.escape(extension)}")
+    return sorted(candidate for candidate in candidates if candidate != path and pattern.fullmatch(candidate))
+
+class JobLedger:
+    """Append-only JSONL journal of per-entry upload state, replayed on startup"""
+
+    def __init__(self, path, read_only=False, others=()):
+        self.path = path
+        self.entries = {}
+        self.read_only = read_only
+        # Done entries of these count unless this ledger has its own record
+        self.others = [JobLedger(other, read_only=True) for other in others]
+        self._torn = False
+        self._load()
+        self._file = None if read_only else open(path, 'a', buffering=1, encoding='utf-8')
+        if self._torn and self._file:
+            # Start the next record on its own line instead of appending to the torn one
+            self._file.write('\n')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
 
-            for entry in entries_to_upload:
+        lines = 0
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                lines += 1
+                self._torn = not line.endswith('\n')
                 try:
-                    success = await process_media_entry(client, entry)
-                    if success:
-                        successful_uploads += 1
-                        logger.info(f"✅ Successfully processed ID {entry['id']}")
+                    record = json.loads(line)
+                    self.entries.setdefault(str(record.pop('id')), {}).update(record)
+                except (ValueError, KeyError):
+                    # A crash can leave a torn last line behind
+                    logger.warning(f"Skipping corrupt ledger line {lines}")
+
+        logger.info(f"Loaded ledger with {len(self.entries)} entries from {self.path}")
+
+        # Rewrite the journal as one line per entry once it has grown enough
+        if lines > 2 * len(self.entries) + 100 and not self.read_only:
+            write_atomic(self.path, ''.join(
+                json.dumps({'id': entry_id, **state}, ensure_ascii=False) + '\n'
+                for entry_id, state in self.entries.items()
+            ))
+            self._torn = False
+
+    def get(self, entry_id):
+        """Return the recorded state of an entry"""
+        return self.entries.get(str(entry_id), {})
+
+    def update(self, entry_id, **fields):
+        """Merge fields into an entry's state and journal them"""
+        entry_id = str(entry_id)
+        fields['updated'] = time.time()
+        self.entries.setdefault(entry_id, {}).update(fields)
+        self._file.write(json.dumps({'id': entry_id, **fields}, ensure_ascii=False) + '\n')
+
+    def is_done(self, entry_id):
+        if str(entry_id) in self.entries:
+            return self.get(entry_id).get('state') == 'done'
+        return any(other.is_done(entry_id) for other in self.others)
+
+    def temp_paths(self):
+        """Temp files of unfinished entries that a later attempt can resume"""
+        return [state['temp_path'] for state in self.entries.values() if state.get('temp_path')]
+
+    def entry(self, entry_id):
+        return LedgerEntry(self, entry_id)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+class LedgerEntry:
+    """One entry's view of the ledger, handed to the download and upload stages"""
+
+    def __init__(self, ledger, entry_id):
+        self.ledger = ledger
+        self.entry_id = entry_id
+
+    def get(self, key, default=None):
+        value = self.ledger.get(self.entry_id).get(key)
+        return default if value is None else value
+
+    def update(self, **fields):
+        self.ledger.update(self.entry_id, **fields)
+
+    def uploaded_part(self, part_num):
+        """Message id of an already posted part, if any"""
+        return self.get('parts', {}).get(str(part_num))
+
+    def record_part(self, part_num, message_id):
+        parts = dict(self.get('parts', {}))
+        parts[str(part_num)] = message_id
+        self.update(parts=parts)
+
+    def transfer(self, part_num):
+        """Saved state of an unfinished Telegram transfer of a part, if any"""
+        return self.get('transfers', {}).get(str(part_num))
+
+    def record_transfer(self, part_num, state):
+        transfers = dict(self.get('transfers', {}))
+        if state is None:
+            transfers.pop(str(part_num), None)
+        else:
+            transfers[str(part_num)] = state
+        self.update(transfers=transfers or None)
+
+    def transfer_session(self):
+        """Session holding an unfinished transfer of this entry, if any"""
+        for state in self.get('transfers', {}).values():
+            return state.get('session')
+        return None
+
+class ChatSequencer:
+    """Grants upload turns so that each chat receives its entries in order"""
+
+    def __init__(self):
+        self._next_turn = {}
+        self._condition = asyncio.Condition()
+
+    async def wait_turn(self, chat_id, turn):
+        """Wait until every earlier turn for this chat has been released"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._next_turn.get(chat_id, 0) == turn)
+
+    async def release_turn(self, chat_id, turn):
+        """Hand the chat over to the next turn"""
+        async with self._condition:
+            self._next_turn[chat_id] = turn + 1
+            self._condition.notify_all()
+
+async def wait_send_turn(job):
+    """Wait until a job may post to its chat, when it is ordered against other jobs"""
+    if job.get('send_turn'):
+        await job['send_turn']()
+
+class ClientPool:
+    """Telegram sessions sharing the upload work, least busy and not FloodWaited first"""
+
+    def __init__(self, clients):
+        self.clients = list(clients)
+        self.load = {client: 0 for client in self.clients}
+
+    async def __aenter__(self):
+        started = []
+        try:
+            for client in self.clients:
+                await client.start()
+                started.append(client)
+        except BaseException:
+            for client in started:
+                await client.stop()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for client in self.clients:
+            try:
+                await client.stop()
+            except Exception as e:
+                logger.warning(f"Error stopping Telegram session: {e}")
+
+    def __len__(self):
+        return len(self.clients)
+
+    def acquire(self, prefer=None):
+        """Pick the least loaded session that is not flood-limited and count a job against it
+
+        ``prefer`` names a session holding a resumable transfer for the job; it
+        is taken whenever it is not flood-limited.
+        """
+        now = time.monotonic()
+        preferred = [
+            c for c in self.clients
+            if prefer and getattr(c, 'name', None) == prefer and get_rate_limiter(c).blocked_until <= now
+        ]
+        client = min(
+            preferred or self.clients,
+            key=lambda c: (max(0.0, get_rate_limiter(c).blocked_until - now), self.load[c])
+        )
+        self.load[client] += 1
+        return client
+
+    def release(self, client):
+        self.load[client] -= 1
+
+async def iter_entries(entries):
+    """Adapt a plain iterable of entries to an async iterator"""
+    for entry in entries:
+        yield entry
+
+class MediaPipeline:
+    """Bounded download/upload pipeline that posts entries in catalog order"""
+
+    def __init__(self, clients, download_workers=None, upload_workers=None, depth=None, ledger=None, dedup=None,
+                 storage=None, probes=None):
+        self.clients = clients if isinstance(clients, ClientPool) else ClientPool([clients])
+        self.ledger = ledger
+        self.dedup = dedup
+        self.storage = storage
+        self.probes = probes or {}
+        self.download_workers = max(1, download_workers or config.DOWNLOAD_CONCURRENCY)
+        self.upload_workers = max(1, upload_workers or config.UPLOAD_CONCURRENCY, len(self.clients))
+        self.depth = max(0, config.PIPELINE_DEPTH if depth is None else depth)
+        if config.MEDIA_GROUP_MAX_SIZE:
+            # Room for a full album to wait for upload
+            self.depth = max(self.depth, MEDIA_GROUP_LIMIT)
+
+        self.download_queue = asyncio.Queue(self.download_workers)
+        self.slots = asyncio.Semaphore(self.download_workers + self.depth)
+        self.prepared = {}
+        self.reservations = {}
+        self.ready = asyncio.Condition()
+        self.taking = asyncio.Lock()
+        self.sequencer = ChatSequencer()
+        self.chat_turns = {}
+        self.next_upload = 0
+        self.total = None
+
+        self.successful_uploads = 0
+        self.failed_uploads = 0
+        self.done = set()
+
+    async def feed(self, entries):
+        """Queue entries (a list or async iterator) for download, numbering them in catalog order"""
+        if not hasattr(entries, '__aiter__'):
+            entries = iter_entries(entries)
+
+        seq = 0
+        async for entry in entries:
+            if self.ledger:
+                if self.ledger.is_done(entry['id']):
+                    logger.info(f"Skipping ID {entry['id']}, already uploaded")
+                    continue
+                if not self.ledger.get(entry['id']):
+                    self.ledger.update(entry['id'], state='pending')
+
+            file_info = self.probes.get(entry['id'])
+            if self.storage:
+                # Reserved in catalog order, so an entry waiting for space never blocks one holding it
+                file_info = await self.admit(entry, file_info)
+                if file_info is None:
+                    continue
+                self.reservations[seq] = file_info['reserved']
+
+            await self.download_queue.put((seq, entry, file_info))
+            seq += 1
+
+        for _ in range(self.download_workers):
+            await self.download_queue.put(None)
+
+        async with self.ready:
+            self.total = seq
+            self.ready.notify_all()
+
+    async def admit(self, entry, file_info=None):
+        """Probe an entry and reserve the temp space it needs, waiting while it does not fit
+
+        A preflight ``file_info`` saves the probe. Returns the probe with the
+        reserved bytes under 'reserved', or None for an entry that could
+        never fit, which is counted as failed.
+        """
+        if self.dedup and self.dedup.lookup(url=entry['link']):
+            # Copied without a download
+            return {'size': 0, 'accept_ranges': False, 'status': None, 'reserved': 0}
+
+        if file_info is None:
+            token = current_entry.set(entry['id'])
+            try:
+                file_info = await probe_file(entry['link'])
+            finally:
+                current_entry.reset(token)
+        file_info = dict(file_info)
+        needed = temp_space_needed(file_info)
+        if not self.storage.fits(needed):
+            logger.error(
+                f"ID {entry['id']} needs {needed / 1024 / 1024:.1f} MB of temp space, "
+                f"only {self.storage.capacity / 1024 / 1024:.1f} MB are available"
+            )
+            self.failed_uploads += 1
+            get_metrics().finish_entry(entry['id'], False)
+            if self.ledger:
+                self.ledger.update(entry['id'], state='failed')
+            return None
+
+        await self.storage.reserve(needed)
+        file_info['reserved'] = needed
+        return file_info
+
+    def checkpoint(self, entry):
+        """Ledger view for an entry, or None without a ledger"""
+        return self.ledger.entry(entry['id']) if self.ledger else None
+
+    async def download_worker(self):
+        """Prepare queued entries until the feeder runs dry"""
+        while True:
+            # Take a slot before the entry so the oldest entry in flight can always finish
+            await self.slots.acquire()
+            item = await self.download_queue.get()
+            if item is None:
+                self.slots.release()
+                return
+
+            seq, entry, file_info = item
+            try:
+                job = await prepare_media_entry(entry, self.checkpoint(entry), self.dedup, file_info)
+            except Exception as e:
+                logger.error(f"Error preparing entry {entry.get('id', 'unknown')}: {e}")
+                job = None
+
+            async with self.ready:
+                self.prepared[seq] = (entry, job)
+                self.ready.notify_all()
+
+    def has_next(self):
+        return self.next_upload in self.prepared or (self.total is not None and self.next_upload >= self.total)
+
+    def pop_next(self):
+        seq = self.next_upload
+        entry, job = self.prepared.pop(seq)
+        self.next_upload += 1
+        return seq, entry, job
+
+    async def next_prepared(self):
+        """Return the next prepared entries in catalog order with their chat turn, or None when done
+
+        Usually that is one entry. A small entry that fits in an album takes
+        the small entries after it along, up to MEDIA_GROUP_LIMIT, waiting at
+        most MEDIA_GROUP_WAIT for each to be prepared. Workers take entries
+        one at a time, so nobody picks up an entry an album is waiting for.
+        """
+        async with self.taking, self.ready:
+            await self.ready.wait_for(self.has_next)
+            if self.next_upload not in self.prepared:
+                return None
+
+            items = [self.pop_next()]
+            if is_group_job(items[0][2], self.checkpoint(items[0][1])):
+                while len(items) < MEDIA_GROUP_LIMIT:
+                    try:
+                        await asyncio.wait_for(self.ready.wait_for(self.has_next), config.MEDIA_GROUP_WAIT)
+                    except asyncio.TimeoutError:
+                        break
+                    if self.next_upload not in self.prepared:
+                        break
+                    entry, job = self.prepared[self.next_upload]
+                    if not is_group_job(job, self.checkpoint(entry)):
+                        break
+                    items.append(self.pop_next())
+
+            chat_id = GROUP_ID
+            turn = self.chat_turns.get(chat_id, 0)
+            self.chat_turns[chat_id] = turn + 1
+            return items, chat_id, turn
+
+    def send_turn(self, chat_id, turn):
+        """Return a coroutine function that waits for a chat turn once and then returns at once"""
+        claimed = False
+
+        async def claim():
+            nonlocal claimed
+            if not claimed:
+                await self.sequencer.wait_turn(chat_id, turn)
+                claimed = True
+
+        return claim
+
+    async def upload_worker(self):
+        """Post prepared entries in order until the pipeline drains
+
+        The chat turn is only claimed right before the first message is sent,
+        so the transfer itself overlaps with earlier entries still posting.
+        """
+        while True:
+            batch = await self.next_prepared()
+            if batch is None:
+                return
+
+            items, chat_id, turn = batch
+            claim_turn = self.send_turn(chat_id, turn)
+            finished = set()
+            try:
+                try:
+                    if len(items) > 1:
+                        results = await self.upload_album(items, claim_turn)
                     else:
-                        failed_uploads += 1
-                        logger.error(f"❌ Failed to process ID {entry['id']}")
+                        results = [await self.upload_entry(*items[0], claim_turn)]
 
-                    # Add delay between entries
-                    await asyncio.sleep(5)
+                    for (seq, entry, job), success in zip(items, results):
+                        self.record_result(entry, success)
+                        finished.add(seq)
+                finally:
+                    await claim_turn()
+                    await self.sequencer.release_turn(chat_id, turn)
 
-                except Exception as e:
-                    logger.error(f"Error processing entry {entry.get('id', 'unknown')}: {e}")
-                    failed_uploads += 1
+            except Exception as e:
+                for seq, entry, job in items:
+                    if seq not in finished:
+                        logger.error(f"Error processing entry {entry.get('id', 'unknown')}: {e}")
+                        get_metrics().finish_entry(entry['id'], False)
+                        self.failed_uploads += 1
+            finally:
+                for seq, entry, job in items:
+                    if job:
+                        cleanup_media_job(job)
+                    if seq in self.reservations:
+                        await self.storage.release(self.reservations.pop(seq))
+                    self.slots.release()
+
+    async def upload_entry(self, seq, entry, job, claim_turn):
+        """Upload one prepared entry and return whether it was posted"""
+        if not job:
+            return False
 
-            logger.info(f"Upload completed. Successful: {successful_uploads}, Failed: {failed_uploads}")
+        checkpoint = self.checkpoint(entry)
+        job['send_turn'] = claim_turn
+        client = self.clients.acquire(checkpoint.transfer_session() if checkpoint else None)
+        try:
+            return await upload_media_job(client, job, checkpoint, self.dedup)
+        finally:
+            self.clients.release(client)
+
+    async def upload_album(self, items, claim_turn):
+        """Post prepared small entries as one album, one by one if the album fails"""
+        jobs = [job for _, _, job in items]
+        checkpoints = [self.checkpoint(entry) for _, entry, _ in items]
+        for job in jobs:
+            job['send_turn'] = claim_turn
+
+        client = self.clients.acquire()
+        try:
+            with get_metrics().stage('upload', items[0][1]['id']):
+                results = await upload_media_group(client, jobs, checkpoints, self.dedup)
+            if results is not None:
+                return results
+        finally:
+            self.clients.release(client)
+
+        logger.warning(f"Album of {len(items)} entries failed, posting them one by one")
+        return [await self.upload_entry(*item, claim_turn) for item in items]
+
+    def record_result(self, entry, success):
+        """Count an entry's outcome and close its ledger record"""
+        get_metrics().finish_entry(entry['id'], success)
+        if success:
+            self.successful_uploads += 1
+            self.done.add(entry['id'])
+            logger.info(f"✅ Successfully processed ID {entry['id']}")
+        else:
+            self.failed_uploads += 1
+            logger.error(f"❌ Failed to process ID {entry['id']}")
+
+        checkpoint = self.checkpoint(entry)
+        if checkpoint:
+            parts = checkpoint.get('parts', {})
+            # A failed entry keeps its partial download so the next run resumes it
+            fields = {'temp_path': None, 'ranges': None} if success else {}
+            checkpoint.update(
+                state='done' if success else 'failed',
+                message_ids=[parts[key] for key in sorted(parts, key=int)],
+                **fields
+            )
+
+    async def run(self, entries):
+        """Process all entries and return (successful, failed) counts"""
+        logger.info(
+            f"Starting pipeline with {self.download_workers} download and "
+            f"{self.upload_workers} upload workers"
+        )
+        workers = [asyncio.create_task(self.download_worker()) for _ in range(self.download_workers)]
+        workers += [asyncio.create_task(self.upload_worker()) for _ in range(self.upload_workers)]
+
+        try:
+            await self.feed(entries)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        return self.successful_uploads, self.failed_uploads
+
+async def select_entries(entries, cache=None, ledger=None):
+    """Keep the entries that still need work
+
+    Without a catalog cache everything is kept. With one, unchanged entries
+    are dropped unless the ledger shows they never completed. Entries that
+    were already uploaded are only posted again when their stored
+    fingerprint changed; without a stored one the current entry becomes
+    the baseline.
+    """
+    async for entry in entries:
+        changed = cache.is_changed(entry['id']) if cache else True
+
+        if ledger and ledger.is_done(entry['id']):
+            if not (cache and cache.is_modified(entry['id'])):
+                if cache:
+                    cache.adopt(entry['id'])
+                continue
+            logger.info(f"ID {entry['id']} changed since it was uploaded, processing it again")
+            ledger.update(entry['id'], state='pending', parts=None, message_ids=None, transfers=None)
+        elif not changed and not ledger:
+            continue
+
+        yield entry
+
+def entry_shard(entry_id):
+    """Shard an entry ID belongs to, the same in every process and run"""
+    if config.SHARD_MODE == 'range':
+        return (int(entry_id) // config.SHARD_BLOCK) % config.SHARD_COUNT
+    digest = hashlib.sha1(str(entry_id).encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % config.SHARD_COUNT
+
+async def select_shard(entries):
+    """Keep the entries of this process's shard"""
+    async for entry in entries:
+        if config.SHARD_COUNT <= 1 or entry_shard(entry['id']) == config.SHARD_INDEX:
+            yield entry
+
+async def chain_entries(first_entry, entries):
+    """Yield an already consumed first entry followed by the rest"""
+    yield first_entry
+    async for entry in entries:
+        yield entry
+
+def write_metrics(metrics):
+    """Export the run report and Prometheus metrics to the configured paths"""
+    stages = metrics.report()['stages']
+    for stage in RunMetrics.STAGES:
+        if stage in stages:
+            totals = stages[stage]
+            logger.info(
+                f"Stage {stage}: {totals['count']} run(s), {totals['seconds']:.1f}s, "
+                f"{totals['bytes_per_second'] / 1024 / 1024:.1f} MB/s"
+            )
+
+    for path, write in ((config.METRICS_PATH, metrics.write_report), (config.METRICS_PROM_PATH, metrics.write_prometheus)):
+        if not path:
+            continue
+        try:
+            write(path)
+            logger.info(f"Wrote run metrics to {path}")
+        except OSError as e:
+            logger.warning(f"Could not write run metrics to {path}: {e}")
+
+def shard_report_path(index):
+    """JSON report a local shard process writes for run_shards to merge"""
+    return f"{os.path.splitext(config.METRICS_PATH)[0]}.shard{index}.json"
+
+async def run_shards(count):
+    """Run the catalog as ``count`` local shard processes and merge their reports
+
+    Every process gets SHARD_INDEX/SHARD_COUNT, its own sessions, state files
+    and temp subdirectory, and an equal share of the temp space. Returns the
+    number of shards that failed.
+    """
+    if len(config.SESSION_STRINGS) < count:
+        raise ConfigError(
+            f"{count} shards need at least {count} session strings in SESSION_STRINGS, got {len(config.SESSION_STRINGS)}; "
+            f"shards sharing a session get it revoked by Telegram"
+        )
+
+    env = dict(os.environ, SHARD_COUNT=str(count))
+    if not config.TEMP_BUDGET:
+        env['TEMP_BUDGET'] = str(max(1, TempStorage().capacity // count))
+    if config.METRICS_PATH:
+        env['METRICS_PROM_PATH'] = ''
+
+    processes = []
+    for index in range(count):
+        shard_env = dict(env, SHARD_INDEX=str(index))
+        if config.METRICS_PATH:
+            shard_env['METRICS_PATH'] = f"{os.path.splitext(config.METRICS_PATH)[0]}.json"
+        processes.append(await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), env=shard_env))
+    logger.info(f"Started {count} shard processes")
+
+    failed = 0
+    for index, process in enumerate(processes):
+        if await process.wait() != 0:
+            logger.error(f"Shard {index + 1}/{count} exited with code {process.returncode}")
+            failed += 1
+
+    if config.METRICS_PATH:
+        merge_reports([shard_report_path(index) for index in range(count)])
+    return failed
+
+def merge_reports(paths):
+    """Merge the JSON reports of shards into the run report and Prometheus export"""
+    reports = []
+    for path in paths:
+        try:
+            with open(path, encoding='utf-8') as f:
+                reports.append(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping shard report {path}: {e}")
+
+    if not reports:
+        logger.error("No shard reports to merge")
+        return
+
+    metrics = RunMetrics.from_reports(reports)
+    done = sum(1 for record in metrics.entries.values() if record['result'] == 'done')
+    failed = sum(1 for record in metrics.entries.values() if record['result'] == 'failed')
+    logger.info(f"Merged {len(reports)} shard reports. Successful: {done}, Failed: {failed}")
+    write_metrics(metrics)
+
+async def plan_catalog():
+    """Load and analyze the catalog without downloading or uploading any media
+
+    Shows what a run would do: how many entries it would process, why the
+    others are skipped and, from the probe cache, how much data that is.
+    The state files of earlier runs are read but never written. Returns
+    the summary.
+    """
+    started = time.monotonic()
+    ledger = JobLedger(
+        config.LEDGER_PATH, read_only=True, others=other_shard_paths(config.LEDGER_PATH)
+    ) if config.LEDGER_PATH else None
+    dedup = DedupIndex(config.DEDUP_INDEX_PATH) if config.DEDUP_INDEX_PATH else None
+    catalog_cache = CatalogCache(config.CATALOG_CACHE_PATH) if config.CATALOG_CACHE_PATH else None
+    # Expired probes are still a fair size estimate
+    probe_cache = ProbeCache(config.PROBE_CACHE_PATH, ttl=math.inf) if config.PROBE_CACHE_PATH else None
+
+    summary = dict.fromkeys((
+        'entries', 'invalid', 'repeated_ids', 'before_start', 'other_shards', 'done', 'unchanged',
+        'known_urls', 'to_process', 'drive_links', 'probed', 'dead', 'bytes', 'split', 'album', 'too_large'
+    ), 0)
+    seen_ids = set()
+    try:
+        async for entry in stream_catalog(None, catalog_cache):
+            summary['entries'] += 1
+            if 'id' not in entry or not entry.get('link'):
+                summary['invalid'] += 1
+                continue
+            entry_id = entry['id']
+            if entry_id in seen_ids:
+                summary['repeated_ids'] += 1
+            seen_ids.add(entry_id)
+
+            changed = catalog_cache.is_changed(entry_id) if catalog_cache else True
+            if entry_id < config.START_FROM_ID:
+                summary['before_start'] += 1
+            elif config.SHARD_COUNT > 1 and entry_shard(entry_id) != config.SHARD_INDEX:
+                summary['other_shards'] += 1
+            elif ledger and ledger.is_done(entry_id) and not (catalog_cache and catalog_cache.is_modified(entry_id)):
+                summary['done'] += 1
+            elif not ledger and not changed:
+                summary['unchanged'] += 1
+            elif dedup and dedup.lookup(url=entry['link']):
+                summary['known_urls'] += 1
+            else:
+                summary['to_process'] += 1
+                summary['drive_links'] += extract_file_id(entry['link']) is not None
+                file_info = probe_cache.get(entry['link']) if probe_cache else None
+                if file_info:
+                    summary['probed'] += 1
+                    summary['dead'] += is_dead_link(file_info)
+                    size = file_info['size']
+                    summary['bytes'] += size
+                    summary['split'] += size > config.MAX_FILE_SIZE
+                    summary['album'] += 0 < size <= config.MEDIA_GROUP_MAX_SIZE
+                    summary['too_large'] += size > config.TELEGRAM_LIMIT * 10
+    finally:
+        if ledger:
+            ledger.close()
+        await close_http_session()
+
+    summary['seconds'] = round(time.monotonic() - started, 3)
+    logger.info(
+        f"Catalog has {summary['entries']} entries: {summary['to_process']} to process, "
+        f"{summary['done']} done, {summary['unchanged']} unchanged, {summary['known_urls']} already posted, "
+        f"{summary['before_start']} before ID {config.START_FROM_ID}, {summary['other_shards']} in other shards"
+    )
+    if summary['invalid'] or summary['repeated_ids']:
+        logger.warning(f"{summary['invalid']} entries without id or link, {summary['repeated_ids']} repeated IDs")
+    logger.info(
+        f"{summary['probed']}/{summary['to_process']} sizes known from the probe cache: "
+        f"{summary['bytes'] / 1024 / 1024 / 1024:.2f} GB, {summary['split']} to split, "
+        f"{summary['album']} for albums, {summary['too_large']} too large, {summary['dead']} dead links"
+    )
+    logger.info(f"{summary['drive_links']} Google Drive links. Planned in {summary['seconds']:.3f}s")
+    return summary
+
+def create_client(name, session_string):
+    """Pyrogram client for one session of the pool"""
+    from pyrogram import Client
+    return Client(name, api_id=config.API_ID, api_hash=config.API_HASH, session_string=session_string)
+
+async def main():
+    """Main function to process and upload media"""
+    try:
+        config.check()
+        metrics = reset_metrics()
+
+        # Resume from the ledger of earlier runs, and skip what other shard layouts already posted
+        ledger = JobLedger(config.LEDGER_PATH, others=other_shard_paths(config.LEDGER_PATH)) if config.LEDGER_PATH else None
+        dedup = DedupIndex(config.DEDUP_INDEX_PATH) if config.DEDUP_INDEX_PATH else None
+        catalog_cache = CatalogCache(config.CATALOG_CACHE_PATH) if config.CATALOG_CACHE_PATH else None
+
+        # Partial downloads the ledger can resume survive the orphan sweep
+        storage = TempStorage()
+        storage.remove_orphans(ledger.temp_paths() if ledger else ())
+        logger.info(f"Temp storage in {storage.directory} with {storage.capacity / 1024 / 1024:.1f} MB budget")
+
+        try:
+            # Stream entries starting from specified ID
+            entries_to_upload = select_entries(
+                select_shard(stream_catalog(config.START_FROM_ID, catalog_cache)), catalog_cache, ledger
+            )
+            first_entry = await anext(entries_to_upload, None)
+            if first_entry is None:
+                logger.info("No entries to upload")
+                if catalog_cache:
+                    catalog_cache.save()
+                return
+
+            logger.info(f"Uploading entries starting from ID {config.START_FROM_ID}")
+            if config.SHARD_COUNT > 1:
+                logger.info(f"Shard {config.SHARD_INDEX + 1}/{config.SHARD_COUNT} ({config.SHARD_MODE} partitioning)")
+            entries_to_upload = chain_entries(first_entry, entries_to_upload)
+
+            # The sweep needs the whole catalog, so it gives up streaming entries into the pipeline
+            probes = None
+            if config.PREFLIGHT:
+                entries_to_upload = [
+                    entry async for entry in entries_to_upload if not (ledger and ledger.is_done(entry['id']))
+                ]
+                probe_cache = ProbeCache(config.PROBE_CACHE_PATH) if config.PROBE_CACHE_PATH else None
+                entries_to_upload, probes = await preflight_entries(entries_to_upload, probe_cache, ledger)
+
+            # Initialize one Pyrogram client per session
+            clients = ClientPool(
+                create_client(f"media_uploader_{i}" if i else "media_uploader", session_string)
+                for i, session_string in enumerate(config.SESSION_STRINGS)
+            )
+
+            async with clients:
+                logger.info(f"Connected to Telegram with {len(clients)} session(s)")
+
+                pipeline = MediaPipeline(clients, ledger=ledger, dedup=dedup, storage=storage, probes=probes)
+                successful_uploads, failed_uploads = await pipeline.run(entries_to_upload)
+
+                logger.info(f"Upload completed. Successful: {successful_uploads}, Failed: {failed_uploads}")
+
+            # Only entries that were posted become the baseline for the next delta
+            if catalog_cache:
+                catalog_cache.save(pipeline.done)
+        finally:
+            if ledger:
+                ledger.close()
+            if dedup:
+                await dedup.flush()
+            await close_http_session()
+            write_metrics(metrics)
 
     except Exception as e:
         logger.error(f"Main function error: {e}")
         raise
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Upload catalog media to Telegram")
+    parser.add_argument('--shards', type=int, default=1, help='run the catalog as this many local shard processes')
+    parser.add_argument('--merge-reports', nargs='+', metavar='REPORT',
+                        help='merge the JSON reports of shard runs into the run report and exit')
+    parser.add_argument('--dry-run', '--plan', action='store_true',
+                        help='load and analyze the catalog without downloading or uploading anything')
+    args = parser.parse_args()
+
+    try:
+        # Only a run that connects to Telegram needs credentials
+        config.check(credentials=not (args.merge_reports or args.dry_run or args.shards > 1))
+
+        if args.merge_reports:
+            merge_reports(args.merge_reports)
+        elif args.dry_run:
+            asyncio.run(plan_catalog())
+        elif args.shards > 1:
+            sys.exit(1 if asyncio.run(run_shards(args.shards)) else 0)
+        else:
+            asyncio.run(main())
+    except ConfigError as e:
+        parser.exit(2, f"{e}\n")
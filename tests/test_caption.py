@@ -0,0 +1,24 @@
+from pyrogram.enums import MessageEntityType
+
+from telegram_uploader import CAPTION_LIMIT, clip_utf16, render_caption, utf16_len
+
+def test_clip_utf16_never_splits_surrogate_pairs():
+    assert utf16_len('a😀b') == 4
+    assert clip_utf16('a😀b', 2) == 'a'
+    assert clip_utf16('a😀b', 3) == 'a😀'
+    assert clip_utf16('abc', -1) == ''
+
+def test_render_caption_entities_use_utf16_offsets():
+    text, entities = render_caption([('🎬 Film', None), ('\n\n📦 ', None), ('Part 1/2', MessageEntityType.BOLD)])
+    assert text == '🎬 Film\n\n📦 Part 1/2'
+    (entity,) = entities
+    assert entity.offset == utf16_len('🎬 Film\n\n📦 ')
+    assert entity.length == len('Part 1/2')
+
+def test_render_caption_shortens_the_title_first():
+    title = '🎬 ' + '名😀' * 1000
+    text, entities = render_caption([(title, None), ('\n\n📁 File: movie.mp4', None),
+                                     ('Part 2/3', MessageEntityType.BOLD)])
+    assert utf16_len(text) <= CAPTION_LIMIT
+    assert text.endswith('…\n\n📁 File: movie.mp4Part 2/3')
+    assert entities[0].offset + entities[0].length == utf16_len(text)
@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+import pytest
+
+import telegram_uploader
+
+CATALOG = [
+    {'id': 1, 'name': 'Ünïcode – 日本語 🎬', 'link': 'https://example.com/a.mp4', 'tvg-logo': ''},
+    {'id': 2, 'name': 'Escapes "quoted" \\ back\nslash\té', 'rating': 1.5, 'score': -2.25e-3},
+    1.5,
+    1e5,
+    -0.0,
+    12345,
+    'plain string',
+    True,
+    None,
+    [1, [2.5e+10, {'nested': 'ok'}]],
+]
+
+async def chunked(data, size):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+def parse(data, size):
+    async def collect():
+        return [element async for element in telegram_uploader.iter_json_array(chunked(data, size))]
+    return asyncio.run(collect())
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_iter_json_array_every_chunk_size(indent):
+    data = json.dumps(CATALOG, ensure_ascii=False, indent=indent).encode()
+    for size in range(1, len(data) + 1):
+        assert parse(data, size) == CATALOG, f"chunk size {size}"
+
+@pytest.mark.parametrize('text', ['[1.5, 2]', '[1e5,2]', '[1E-5 ,true]', '[-12]'])
+def test_iter_json_array_numbers_cut_at_every_byte(text):
+    expected = json.loads(text)
+    for size in range(1, len(text) + 1):
+        assert parse(text.encode(), size) == expected
+
+def test_iter_json_array_rejects_truncated_catalog():
+    with pytest.raises(ValueError):
+        parse(b'[{"id": 1}, {"id": 2}', 4)
+
+def test_iter_json_array_rejects_non_array():
+    with pytest.raises(ValueError):
+        parse(b'{"id": 1}', 4)
+
+def test_stream_catalog_ignores_stale_spool(tmp_path, monkeypatch):
+    from aiohttp import web
+
+    body = json.dumps(CATALOG[:2]).encode()
+
+    async def catalog(request):
+        return web.Response(body=body)
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/media_data.json', catalog)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(telegram_uploader.config, 'GOOGLE_DRIVE_JSON_URL', f"http://127.0.0.1:{port}/media_data.json")
+        try:
+            return [entry async for entry in telegram_uploader.stream_catalog()]
+        finally:
+            await telegram_uploader.close_http_session()
+            await runner.cleanup()
+
+    monkeypatch.chdir(tmp_path)
+    # Left behind by a crashed run
+    (tmp_path / 'media_data.json.part').write_text('[{"id": 99, "name" oops')
+    assert asyncio.run(run()) == CATALOG[:2]
+    assert json.loads((tmp_path / 'media_data.json').read_text()) == CATALOG[:2]
@@ -0,0 +1,63 @@
+import pytest
+
+from telegram_uploader import Config, ConfigError
+
+CREDENTIALS = {'API_ID': '12345', 'API_HASH': 'hash', 'SESSION_STRING': 'session'}
+
+def test_defaults_need_no_environment():
+    config = Config({})
+    assert config.errors == []
+    assert config.MAX_RETRIES == 3
+    assert config.STREAM_MODE is False
+    config.check(credentials=False)
+
+def test_missing_credentials_are_only_required_to_connect():
+    config = Config({})
+    with pytest.raises(ConfigError, match='API_ID'):
+        config.check()
+    Config(CREDENTIALS).check()
+
+def test_empty_values_fall_back_to_defaults():
+    config = Config(dict(CREDENTIALS, START_FROM_ID='', PIPELINE_DEPTH='', SPLIT_MODE=''))
+    assert config.errors == []
+    assert (config.START_FROM_ID, config.PIPELINE_DEPTH, config.SPLIT_MODE) == (0, 1, 'view')
+
+def test_every_invalid_value_is_reported():
+    config = Config(dict(
+        CREDENTIALS, MAX_RETRIES='three', DOWNLOAD_CONNECTIONS='0', SEND_RATE='fast',
+        SPLIT_MODE='zip', WRITE_BUFFER_MIN='9', WRITE_BUFFER_MAX='4'
+    ))
+    with pytest.raises(ConfigError) as error:
+        config.check()
+    message = str(error.value)
+    for name in ('MAX_RETRIES', 'DOWNLOAD_CONNECTIONS', 'SEND_RATE', 'SPLIT_MODE', 'WRITE_BUFFER_MIN'):
+        assert name in message
+
+@pytest.mark.parametrize('value, expected', [
+    ('1', True), ('true', True), ('Yes', True), ('0', False), ('FALSE', False), ('no', False),
+])
+def test_flags_accept_common_spellings(value, expected):
+    config = Config({'STREAM_MODE': value})
+    assert config.errors == []
+    assert config.STREAM_MODE is expected
+
+def test_flags_reject_anything_else():
+    config = Config({'PREFLIGHT': 'on please'})
+    assert config.PREFLIGHT is False
+    assert any('PREFLIGHT' in error for error in config.errors)
+
+def test_shards_get_their_own_sessions_and_state_files():
+    config = Config(dict(CREDENTIALS, SHARD_COUNT='2', SHARD_INDEX='1', SESSION_STRINGS='a,b,c'))
+    assert config.errors == []
+    assert config.SESSION_STRINGS == ['b']
+    assert config.LEDGER_PATH == 'upload_ledger.shard1.jsonl'
+    assert config.CATALOG_PATH == 'media_data.json'
+
+def test_shards_never_share_a_session():
+    config = Config(dict(CREDENTIALS, SHARD_COUNT='4', SHARD_INDEX='0'))
+    with pytest.raises(ConfigError, match='session strings'):
+        config.check()
+
+def test_shard_index_must_be_below_shard_count():
+    config = Config(dict(CREDENTIALS, SHARD_COUNT='2', SHARD_INDEX='2', SESSION_STRINGS='a b'))
+    assert any('SHARD_INDEX' in error for error in config.errors)
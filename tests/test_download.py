@@ -0,0 +1,95 @@
+import asyncio
+
+from aiohttp import web
+
+import benchmark
+import telegram_uploader
+
+class VerifyingCheckpoint:
+    """Ledger entry stand-in that checks every checkpointed range against the file on disk"""
+
+    def __init__(self, path, payload):
+        self.path = path
+        self.payload = payload
+        self.syncs = 0
+        self.unwritten = []
+
+    def get(self, key, default=None):
+        return default
+
+    def update(self, **fields):
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        # Recorded rather than raised, download_ranged would retry the range
+        for start, end, done in fields['ranges']:
+            if content[start:start + done] != self.payload[start:start + done]:
+                self.unwritten.append((start, done))
+        self.syncs += 1
+
+def test_ranged_download_checkpoints_only_flushed_bytes(tmp_path, monkeypatch):
+    config = telegram_uploader.config
+    monkeypatch.setattr(config, 'WRITE_BUFFER_MIN', 4 * 1024 * 1024)
+    monkeypatch.setattr(config, 'WRITE_BUFFER_MAX', 4 * 1024 * 1024)
+    monkeypatch.setattr(config, 'LEDGER_SYNC_BYTES', 256 * 1024)
+    payload = benchmark.make_payload(4 * 1024 * 1024)
+    path = str(tmp_path / 'video.mp4')
+    checkpoint = VerifyingCheckpoint(path, payload)
+
+    async def video(request):
+        start, stop = request.http_range.start, request.http_range.stop
+        response = web.StreamResponse(status=206, headers={
+            'Content-Range': f"bytes {start}-{stop - 1}/{len(payload)}", 'Content-Length': str(stop - start)
+        })
+        await response.prepare(request)
+        for offset in range(start, stop, 64 * 1024):
+            await response.write(payload[offset:min(offset + 64 * 1024, stop)])
+            await asyncio.sleep(0.01)
+            if start and offset == start + 128 * 1024:
+                # The second range stalls with bytes in its write buffer while the first one syncs
+                await asyncio.sleep(0.5)
+        await response.write_eof()
+        return response
+
+    async def download():
+        app = web.Application()
+        app.router.add_get('/video.mp4', video)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            session = telegram_uploader.get_http_session()
+            return await telegram_uploader.download_ranged(
+                session, f"http://127.0.0.1:{port}/video.mp4", path, len(payload), 2, checkpoint
+            )
+        finally:
+            await telegram_uploader.close_http_session()
+            await runner.cleanup()
+
+    assert asyncio.run(download())
+    assert checkpoint.syncs > 2
+    assert checkpoint.unwritten == []
+    with open(path, 'rb') as f:
+        assert f.read() == payload
+
+def test_ranged_download_notices_a_file_that_grew_since_the_probe(tmp_path, monkeypatch):
+    config = telegram_uploader.config
+    monkeypatch.setattr(config, 'TEMP_DIR', str(tmp_path))
+    monkeypatch.setattr(config, 'MIN_RANGE_SIZE', 256 * 1024)
+    payload = benchmark.make_payload(4 * 1024 * 1024)
+    # A cached probe from before the file grew
+    file_info = {'size': 3 * 1024 * 1024, 'accept_ranges': True, 'status': 200}
+
+    async def download():
+        server = benchmark.LocalMediaServer(payload)
+        base_url = await server.start()
+        try:
+            return await telegram_uploader.download_file(f"{base_url}/video.mp4", 'video.mp4', file_info=file_info)
+        finally:
+            await telegram_uploader.close_http_session()
+            await server.stop()
+
+    path = asyncio.run(download())
+    with open(path, 'rb') as f:
+        assert f.read() == payload
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import benchmark
+import telegram_uploader
+from telegram_uploader import plan_keyframe_cuts
+
+def segment_sizes(keyframes, file_size, cuts):
+    offsets = dict(keyframes)
+    bounds = [keyframes[0][1]] + [offsets[cut] for cut in cuts] + [file_size]
+    return [end - start for start, end in zip(bounds, bounds[1:])]
+
+def test_keyframe_cuts_keep_segments_within_budget():
+    # A keyframe every second, GOPs of 10 to 19 bytes
+    keyframes = []
+    offset = 0
+    for second in range(40):
+        keyframes.append((float(second), offset))
+        offset += 10 + second % 10
+    cuts = plan_keyframe_cuts(keyframes, offset, budget=50)
+
+    sizes = segment_sizes(keyframes, offset, cuts)
+    assert sum(sizes) == offset
+    assert max(sizes) <= 50
+    # Every cut is at the last keyframe that fits, so the next GOP would not have
+    gops = dict((time, end - start) for (time, start), (_, end) in zip(keyframes, keyframes[1:]))
+    for size, cut in zip(sizes, cuts):
+        assert size + gops[cut] > 50
+
+def test_keyframe_cuts_without_a_cut():
+    assert plan_keyframe_cuts([(0.0, 0), (1.0, 10)], 20, budget=20) == []
+
+def test_keyframe_cuts_give_up_on_oversized_gop():
+    assert plan_keyframe_cuts([(0.0, 0), (1.0, 10), (2.0, 80)], 90, budget=30) is None
+    assert plan_keyframe_cuts([(0.0, 0), (1.0, 10)], 100, budget=30) is None
+    assert plan_keyframe_cuts([], 100, budget=30) is None
+
+@pytest.mark.skipif(not (shutil.which('ffmpeg') and shutil.which('ffprobe')), reason='needs ffmpeg and ffprobe')
+def test_split_keyframes_makes_playable_parts_within_the_budget(tmp_path):
+    source = str(tmp_path / 'video.mp4')
+    benchmark.make_video(source, duration=6, gop=30)
+    chunk_size = os.path.getsize(source) // 2
+
+    parts = asyncio.run(telegram_uploader.split_keyframes(source, chunk_size))
+
+    assert len(parts) > 1
+    for part_path, part_filename in parts:
+        # A byte-range view would mean the keyframe split fell back
+        assert isinstance(part_path, str)
+        assert os.path.basename(part_path) == part_filename
+        assert os.path.getsize(part_path) <= chunk_size
+        # Decoding the whole part catches segments that do not start on a keyframe
+        decoded = subprocess.run(['ffmpeg', '-v', 'error', '-i', part_path, '-f', 'null', '-'],
+                                 capture_output=True, text=True)
+        assert decoded.returncode == 0 and not decoded.stderr.strip()
@@ -0,0 +1,98 @@
+import asyncio
+import tempfile
+
+import pytest
+from pyrogram import raw
+
+import benchmark
+import telegram_uploader
+
+class RecordingClient(benchmark.FakeTelegramClient):
+    """Fake client that records the first caption line of every posted message in a shared list"""
+
+    def __init__(self, name, posts, fail_parts=0, fail_upload_media=False):
+        super().__init__(name)
+        self.posts = posts
+        self.fail_parts = fail_parts
+        self.fail_upload_media = fail_upload_media
+
+    async def invoke(self, query):
+        if isinstance(query, raw.functions.upload.SaveFilePart) and self.fail_parts:
+            self.fail_parts -= 1
+            raise ConnectionError("connection reset")
+        if isinstance(query, raw.functions.messages.UploadMedia) and self.fail_upload_media:
+            raise ConnectionError("connection reset")
+
+        result = await super().invoke(query)
+        if isinstance(query, raw.functions.messages.SendMedia):
+            self.posts.append(query.message.splitlines()[0])
+        elif isinstance(query, raw.functions.messages.SendMultiMedia):
+            self.posts.extend(single.message.splitlines()[0] for single in query.multi_media)
+        return result
+
+@pytest.fixture
+def uploader(tmp_path, monkeypatch):
+    """Config for fast local pipeline runs in a temp directory"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    config = telegram_uploader.config
+    for name, value in (
+        ('MAX_RETRIES', 1), ('SEND_RATE', 1000.0), ('SEND_RATE_MAX', 1000.0), ('SEND_BURST', 100),
+        ('MEDIA_GROUP_MAX_SIZE', 0), ('MEDIA_GROUP_WAIT', 1), ('STREAM_MODE', False), ('SHARD_COUNT', 1)
+    ):
+        monkeypatch.setattr(config, name, value)
+    telegram_uploader.reset_metrics()
+    return config
+
+def make_entries(base_url, count):
+    return [
+        {'id': i, 'name': f"Sample video {i}", 'link': f"{base_url}/video_{i}.mp4", 'tvg-logo': ''}
+        for i in range(1, count + 1)
+    ]
+
+async def run_pipeline(clients, count, **kwargs):
+    files = {f"video_{i}.mp4": benchmark.make_payload(64 * 1024 + i) for i in range(1, count + 1)}
+    server = benchmark.LocalMediaServer(b'', files=files)
+    base_url = await server.start()
+    try:
+        pipeline = telegram_uploader.MediaPipeline(telegram_uploader.ClientPool(clients), **kwargs)
+        return await pipeline.run(make_entries(base_url, count))
+    finally:
+        await telegram_uploader.close_http_session()
+        await server.stop()
+
+@pytest.mark.parametrize('failure', ['transfer', 'upload_media'])
+def test_failed_album_falls_back_to_single_posts(uploader, failure):
+    uploader.MEDIA_GROUP_MAX_SIZE = 1024 * 1024
+    posts = []
+    client = RecordingClient(
+        'media_uploader', posts, fail_parts=int(failure == 'transfer'), fail_upload_media=failure == 'upload_media'
+    )
+
+    assert asyncio.run(run_pipeline([client], 3)) == (3, 0)
+    assert posts == [f"🎬 Sample video {i}" for i in range(1, 4)]
+
+def test_posts_keep_id_order_while_downloads_overlap(uploader, monkeypatch):
+    prepare = telegram_uploader.prepare_media_entry
+    delays = {1: 0.3, 2: 0.0, 3: 0.2, 4: 0.05, 5: 0.25, 6: 0.0, 7: 0.1, 8: 0.0}
+    preparing = []
+    overlapped = []
+
+    async def uneven_prepare(entry, *args, **kwargs):
+        preparing.append(entry['id'])
+        overlapped.append(len(preparing))
+        try:
+            await asyncio.sleep(delays[entry['id']])
+            return await prepare(entry, *args, **kwargs)
+        finally:
+            preparing.remove(entry['id'])
+
+    monkeypatch.setattr(telegram_uploader, 'prepare_media_entry', uneven_prepare)
+    posts = []
+    clients = [RecordingClient('media_uploader', posts), RecordingClient('media_uploader_1', posts)]
+    clients[1].latency = 0.05
+
+    result = asyncio.run(run_pipeline(clients, len(delays), download_workers=4, upload_workers=2, depth=2))
+    assert result == (len(delays), 0)
+    assert posts == [f"🎬 Sample video {i}" for i in range(1, len(delays) + 1)]
+    assert max(overlapped) > 1
@@ -0,0 +1,13 @@
+from telegram_uploader import config, entry_shard
+
+def test_entry_shard_partitions_ids(monkeypatch):
+    monkeypatch.setattr(config, 'SHARD_COUNT', 4)
+    monkeypatch.setattr(config, 'SHARD_MODE', 'hash')
+    shards = [entry_shard(entry_id) for entry_id in range(4000)]
+    assert shards == [entry_shard(str(entry_id)) for entry_id in range(4000)]
+    assert all(800 < shards.count(shard) < 1200 for shard in range(4))
+
+    monkeypatch.setattr(config, 'SHARD_MODE', 'range')
+    monkeypatch.setattr(config, 'SHARD_BLOCK', 100)
+    assert {entry_shard(entry_id) for entry_id in range(100, 200)} == {1}
+    assert [entry_shard(entry_id * 100) for entry_id in range(6)] == [0, 1, 2, 3, 0, 1]
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+
+import telegram_uploader
+
+def observe(cache_path, entries):
+    cache = telegram_uploader.CatalogCache(str(cache_path))
+    for entry in entries:
+        cache.observe(entry)
+    return cache
+
+def test_catalog_cache_keeps_unfinished_entries_changed(tmp_path):
+    path = tmp_path / 'catalog_cache.json'
+    catalog = [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, {'id': 3, 'name': 'c'}]
+
+    # Entry 2 failed and entry 3 was never selected
+    observe(path, catalog).save(done={1})
+    assert observe(path, catalog).delta == {'2', '3'}
+
+    observe(path, catalog).save(done={2})
+    catalog[0]['name'] = 'a2'
+    assert observe(path, catalog).delta == {'1', '3'}
+
+def test_done_entries_without_a_stored_fingerprint_become_the_baseline(tmp_path):
+    path = tmp_path / 'catalog_cache.json'
+    catalog = [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, {'id': 3, 'name': 'c'}]
+    ledger = telegram_uploader.JobLedger(str(tmp_path / 'upload_ledger.jsonl'))
+    ledger.update(1, state='done', message_ids=[11])
+    ledger.update(2, state='done', message_ids=[12])
+
+    async def select(cache):
+        async def entries():
+            for entry in catalog:
+                if cache:
+                    cache.observe(entry)
+                yield entry
+        return [entry['id'] async for entry in telegram_uploader.select_entries(entries(), cache, ledger)]
+
+    # No cache file yet, or no cache at all: done entries are not posted again
+    assert asyncio.run(select(None)) == [3]
+    cache = telegram_uploader.CatalogCache(str(path))
+    assert asyncio.run(select(cache)) == [3]
+    cache.save()
+
+    # The adopted fingerprints now catch real changes
+    catalog[1]['name'] = 'b2'
+    assert asyncio.run(select(telegram_uploader.CatalogCache(str(path)))) == [2, 3]
+    assert not ledger.is_done(2)
+    ledger.close()
+
+def test_dedup_index_skips_records_without_message_ids(tmp_path):
+    path = str(tmp_path / 'dedup_index.json')
+    dedup = telegram_uploader.DedupIndex(path)
+    dedup.record('https://example.com/a.mp4', 'hash-a', '@chat', [True])
+    dedup.record('https://example.com/b.mp4', 'hash-b', '@chat', [])
+    dedup.record('https://example.com/c.mp4', 'hash-c', '@chat', [41, 42])
+
+    reloaded = telegram_uploader.DedupIndex(path)
+    assert reloaded.lookup(url='https://example.com/a.mp4') is None
+    assert reloaded.lookup(content_hash='hash-b') is None
+    assert reloaded.lookup(content_hash='hash-c') == {'chat_id': '@chat', 'message_ids': [41, 42]}
+
+def test_dedup_index_saves_in_the_executor_and_coalesces_records(tmp_path):
+    path = str(tmp_path / 'dedup_index.json')
+    dedup = telegram_uploader.DedupIndex(path)
+    threads = []
+    write = dedup._write
+    dedup._write = lambda urls, hashes: (threads.append(threading.current_thread()), write(urls, hashes))
+
+    async def post_all():
+        for i in range(50):
+            dedup.record(f'https://example.com/{i}.mp4', f'hash-{i}', '@chat', [i + 1])
+        await dedup.flush()
+
+    asyncio.run(post_all())
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
+    reloaded = telegram_uploader.DedupIndex(path)
+    assert len(reloaded.urls) == 50
+    assert reloaded.lookup(content_hash='hash-49') == {'chat_id': '@chat', 'message_ids': [50]}
+
+def test_job_ledger_replays_past_a_torn_last_line(tmp_path):
+    path = str(tmp_path / 'upload_ledger.jsonl')
+    ledger = telegram_uploader.JobLedger(path)
+    ledger.update(1, state='downloading', temp_path='/tmp/a')
+    ledger.update(2, state='done', message_ids=[7])
+    ledger.update(1, downloaded=1024)
+    ledger.close()
+    # A crash in the middle of a write
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"id": "1", "state": "do')
+
+    ledger = telegram_uploader.JobLedger(path)
+    assert ledger.get(1)['state'] == 'downloading'
+    assert ledger.get(1)['downloaded'] == 1024
+    assert ledger.is_done(2)
+    assert ledger.temp_paths() == ['/tmp/a']
+
+    # Later updates start on a fresh line and replay as well
+    ledger.update(1, state='done')
+    ledger.close()
+    assert telegram_uploader.JobLedger(path, read_only=True).is_done(1)
+
+def test_job_ledger_counts_entries_done_under_other_shard_layouts(tmp_path):
+    def write_ledger(name, **states):
+        ledger = telegram_uploader.JobLedger(str(tmp_path / name))
+        for entry_id, state in states.items():
+            ledger.update(entry_id, state=state)
+        ledger.close()
+
+    write_ledger('upload_ledger.jsonl', **{'1': 'done', '2': 'done'})
+    write_ledger('upload_ledger.shard1.jsonl', **{'3': 'done', '4': 'failed'})
+    write_ledger('upload_ledger_old.jsonl', **{'5': 'done'})
+    (tmp_path / 'upload_ledger.shard1.jsonl.tmp').write_text('')
+
+    # Now shard 0 of a new layout, which already reset entry 2
+    path = str(tmp_path / 'upload_ledger.shard0.jsonl')
+    write_ledger('upload_ledger.shard0.jsonl', **{'2': 'pending'})
+    others = telegram_uploader.other_shard_paths(path)
+    assert others == [str(tmp_path / 'upload_ledger.jsonl'), str(tmp_path / 'upload_ledger.shard1.jsonl')]
+
+    ledger = telegram_uploader.JobLedger(path, others=others)
+    assert [entry_id for entry_id in range(1, 6) if ledger.is_done(entry_id)] == [1, 3]
+    ledger.close()
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+import telegram_uploader
+
+def test_ring_buffer_passes_data_through_in_order():
+    payload = bytes(range(256)) * 40
+
+    async def run():
+        ring = telegram_uploader.RingBuffer(7)
+
+        async def produce():
+            for start in range(0, len(payload), 13):
+                await ring.write(payload[start:start + 13])
+            await ring.close()
+
+        producer = asyncio.create_task(produce())
+        received = bytearray()
+        while chunk := await ring.read(5):
+            received += chunk
+        await producer
+        return bytes(received)
+
+    assert asyncio.run(run()) == payload
+
+def test_ring_buffer_raises_the_producer_error():
+    async def run():
+        ring = telegram_uploader.RingBuffer(16)
+        await ring.write(b'abc')
+        await ring.close(ConnectionError('cut off'))
+        return await ring.read(3)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from pyrogram import raw
+from pyrogram.errors import FilePartMissing
+
+import benchmark
+import telegram_uploader
+from telegram_uploader import UPLOAD_PART_SIZE
+
+FILE_PARTS = 24  # Over 10 MB, so the transfer is resumable
+
+class PartRecordingClient(benchmark.FakeTelegramClient):
+    """Fake client that records every saved file part and can fail one part or the first send"""
+
+    def __init__(self, name, fail_part=None, lose_parts=False):
+        super().__init__(name)
+        self.saved_parts = []
+        self.fail_part = fail_part
+        self.lose_parts = lose_parts
+
+    async def invoke(self, query):
+        if isinstance(query, raw.functions.upload.SaveBigFilePart):
+            if query.file_part == self.fail_part:
+                self.fail_part = None
+                raise ConnectionError("connection reset")
+            self.saved_parts.append((query.file_id, query.file_part))
+        elif isinstance(query, raw.functions.messages.SendMedia) and self.lose_parts:
+            self.lose_parts = False
+            raise FilePartMissing(value=3)
+        return await super().invoke(query)
+
+@pytest.fixture
+def upload(tmp_path, monkeypatch):
+    """Upload a FILE_PARTS video through a client against one ledger entry"""
+    config = telegram_uploader.config
+    for name, value in (('SEND_RATE', 1000.0), ('SEND_RATE_MAX', 1000.0), ('UPLOAD_PART_WORKERS', 1)):
+        monkeypatch.setattr(config, name, value)
+    video_path = tmp_path / 'video.mp4'
+    video_path.write_bytes(benchmark.make_payload(FILE_PARTS * UPLOAD_PART_SIZE))
+    ledger = telegram_uploader.JobLedger(str(tmp_path / 'upload_ledger.jsonl'))
+
+    def run(client, retries=1):
+        monkeypatch.setattr(config, 'MAX_RETRIES', retries)
+        return asyncio.run(telegram_uploader.upload_video_to_telegram(
+            client, str(video_path), 'video.mp4', ('Video', []), checkpoint=ledger.entry(1)
+        ))
+
+    yield run, ledger
+    ledger.close()
+
+def test_failed_transfer_resumes_at_the_failed_part(upload):
+    run, ledger = upload
+    first = PartRecordingClient('media_uploader', fail_part=7)
+    assert run(first) is None
+    assert [part for _, part in first.saved_parts] == list(range(7))
+    assert ledger.entry(1).transfer(1)['saved'] == 7
+
+    second = PartRecordingClient('media_uploader')
+    assert run(second) == 1
+    assert [part for _, part in second.saved_parts] == list(range(7, FILE_PARTS))
+    # The same file id, so Telegram joins the parts of both runs
+    assert {file_id for file_id, _ in first.saved_parts + second.saved_parts} == {first.saved_parts[0][0]}
+    assert ledger.entry(1).transfer(1) is None
+
+def test_transfer_of_another_session_starts_over(upload):
+    run, _ = upload
+    first = PartRecordingClient('media_uploader', fail_part=7)
+    assert run(first) is None
+
+    # Parts saved by one session are invisible to another
+    other = PartRecordingClient('media_uploader_1')
+    assert run(other) == 1
+    assert [part for _, part in other.saved_parts] == list(range(FILE_PARTS))
+    assert other.saved_parts[0][0] != first.saved_parts[0][0]
+
+def test_missing_file_parts_restart_under_a_new_file_id(upload):
+    run, _ = upload
+    client = PartRecordingClient('media_uploader', lose_parts=True)
+    assert run(client, retries=2) == 1
+
+    file_ids = [file_id for file_id, _ in client.saved_parts]
+    assert [part for _, part in client.saved_parts] == list(range(FILE_PARTS)) * 2
+    assert file_ids[0] != file_ids[-1] and len(set(file_ids)) == 2